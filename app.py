@@ -4,24 +4,67 @@ Crops: Coconut, Arecanut, Pepper
 Region: Karnataka
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+import time
+
+# Start of application import, used to measure cold-start time
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, send_file, Response, g, abort
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
-import pickle
-import pandas as pd
-import numpy as np
+import gc
+import hmac
+import threading
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
 import io
 import base64
-from model.train_model_if_needed import train_model_if_needed
-from model.predict import predict_price
+import traceback
+import metrics
+import profiler
+import http_cache
+import ratelimit
+import snapshots
+from lazy_import import lazy_import, preload
+from model.train_model_if_needed import train_model_if_needed, should_retrain_model
+from model.predict import predict_price, load_model, is_model_loaded
 from data.data_handler import get_historical_data, update_daily_data, get_last_updated_date
+from data import aggregates, history, monitor
+
+# Heavy libraries are imported on first use (or by warmup()) to keep startup fast
+pd = lazy_import('pandas')
+plt = lazy_import('matplotlib.pyplot', on_import=lambda module: module.switch_backend('Agg'))  # Non-interactive backend
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'crop-price-prediction-karnataka-2024'
 
+# Number of reverse proxies in front of the app (1 on Render); their X-Forwarded-For
+# entries are trusted to identify clients for rate limiting
+PROXY_COUNT = int(os.environ.get('PROXY_COUNT', '0'))
+if PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT, x_proto=PROXY_COUNT)
+
+# Token for admin-only features (profiling, profile downloads, /update); unset disables
+# profiling and leaves /update open
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Seconds clients and proxies may reuse a GET /api/predict response without revalidating
+API_CACHE_MAX_AGE = int(os.environ.get('API_CACHE_MAX_AGE', '300'))
+
+# Most points plotted for the historical prices on the trend graph (downsampled beyond that)
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', '400'))
+
+# Historical points are drawn with markers only up to this many points
+CHART_MARKER_MAX_POINTS = 60
+
+# Most points GET /api/history returns
+HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', '5000'))
+
+# Seconds warmup waits for the training slot while another worker trains the model
+WARMUP_TRAINING_TIMEOUT = 600
+
+# Request profiling is only wired in when it can actually be triggered
+PROFILING_ENABLED = bool(ADMIN_TOKEN) or profiler.PROFILE_SAMPLE_RATE > 0
+
 # Karnataka districts list
 KARNATAKA_DISTRICTS = [
     'Bagalkot', 'Ballari', 'Belagavi', 'Bengaluru Rural', 'Bengaluru Urban',
@@ -34,25 +77,230 @@ KARNATAKA_DISTRICTS = [
 # Valid crops
 VALID_CROPS = ['Coconut', 'Arecanut', 'Pepper']
 
+# Startup state reported by /ready
+_startup = {'import_seconds': None, 'warmup_seconds': None, 'warmed_up': False}
+_warmup_lock = threading.Lock()
+
+# Per-client, per-route request limits (None when disabled)
+rate_limiter = ratelimit.create_rate_limiter()
+
+
+@app.before_request
+def start_request_timer():
+    """
+    Start collecting stage timings for this request
+    """
+    metrics.begin_request()
+
+
+def busy_response(status, message, retry_after):
+    """
+    Fast rejection of a request (429 rate limited, 503 overloaded) with a Retry-After header
+    JSON for API-style routes, the error page for the web interface
+    """
+    if request.path.startswith('/api/') or request.endpoint == 'update_data':
+        response = jsonify({'error': message, 'retry_after': retry_after})
+    else:
+        response = Response(render_template('error.html', error_message=message), mimetype='text/html')
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@app.before_request
+def enforce_rate_limit():
+    """
+    Reject clients that exceed the rate limit of the requested route with 429
+    """
+    if rate_limiter is None or request.endpoint is None:
+        return None
+    retry_after = rate_limiter.check(request.endpoint, request.remote_addr)
+    if retry_after:
+        return busy_response(429, f"Too many requests. Please try again in {retry_after} seconds.", retry_after)
+    return None
+
+
+@app.before_request
+def pin_snapshots():
+    """
+    Pin the current data and model snapshots, so the whole request reads one consistent
+    version even if an update or retrain publishes a new one meanwhile
+    """
+    snapshots.pin()
+
+
+@app.teardown_request
+def unpin_snapshots(exception=None):
+    """
+    Release the request's snapshot pins
+    """
+    snapshots.unpin()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Record request count and duration, and log slow requests
+    """
+    metrics.end_request(request.endpoint, request.method, response.status_code)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress HTML, JSON and text responses (gzip or brotli) for clients that accept it
+    """
+    return http_cache.compress_response(response)
+
+
+@app.url_defaults
+def hash_static_urls(endpoint, values):
+    """
+    Make url_for('static', filename=...) produce content-hashed file names, so static
+    files can be cached for a year and still update immediately after a deploy
+    """
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = http_cache.hashed_static_name(app.static_folder, values['filename'])
+
+
+def serve_static_file(filename):
+    """
+    Serve static files, with long-lived cache headers for content-hashed names
+    """
+    return http_cache.serve_static(app.static_folder, filename)
+
+
+app.view_functions['static'] = serve_static_file
+
+
+def page_etag(*parts):
+    """
+    ETag of a response that depends on the deployed templates, the data and model the
+    request reads, and the given values
+    """
+    return http_cache.make_etag(http_cache.build_id(app.template_folder, app.static_folder),
+                                snapshots.version_key('data', 'crop_price_data.csv'),
+                                snapshots.version_key('model', 'trained_model.pkl'),
+                                *parts)
+
+
+def is_admin_request():
+    """
+    Check the X-Admin-Token header against ADMIN_TOKEN
+    """
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def start_request_profiler():
+    """
+    Start a sampling profiler if the request asks for one (X-Profile header plus
+    admin token) or is picked by PROFILE_SAMPLE_RATE
+    """
+    requested = request.headers.get('X-Profile') == '1' and is_admin_request()
+    if requested or profiler.should_sample():
+        g.profiler = profiler.SamplingProfiler().start()
+
+
+def save_request_profile(response):
+    """
+    Stop the request profiler and store the profile on disk
+    """
+    request_profiler = g.pop('profiler', None)
+    if request_profiler is not None:
+        request_profiler.stop()
+        label = f"{request.method}-{request.endpoint or 'unknown'}-{response.status_code}"
+        response.headers['X-Profile-Id'] = profiler.save_profile(request_profiler, label)
+    return response
+
+
+def stop_request_profiler(exception=None):
+    """
+    Make sure the sampler thread stops even if the request raised
+    """
+    request_profiler = g.pop('profiler', None)
+    if request_profiler is not None:
+        request_profiler.stop()
+
+
+# Registered only when enabled so requests pay nothing when profiling is off
+if PROFILING_ENABLED:
+    app.before_request(start_request_profiler)
+    app.after_request(save_request_profile)
+    app.teardown_request(stop_request_profiler)
+
+
+def ensure_model_trained():
+    """
+    Train the model if needed, recording whether the existing model was reused
+    Only TRAINING_CONCURRENCY requests train at a time; while training is busy, requests
+    are served with the existing model right away if there is one, and only wait for a
+    slot (up to TRAINING_QUEUE_TIMEOUT) if there is none
+    Returns True if a usable model is available
+    Raises ratelimit.Overloaded if there is no model and training is busy
+    """
+    with metrics.timed('train_model_if_needed'):
+        if not should_retrain_model():
+            metrics.inc('model_cache_hits_total')
+            return True
+        
+        timeout = 0 if is_model_loaded() else None
+        if not ratelimit.training_limiter.try_acquire(timeout):
+            if load_model()[0] is not None:
+                metrics.inc('model_cache_hits_total')
+                return True
+            raise ratelimit.Overloaded('train_model', 30)
+        try:
+            # Another request may have finished training while this one waited; its model
+            # is newer than the one pinned at the start of this request, so read that one
+            snapshots.repin('model')
+            if not should_retrain_model():
+                metrics.inc('model_cache_hits_total')
+                return True
+            metrics.inc('model_retrains_total', reason='stale')
+            return train_model_if_needed(force_retrain=True)
+        finally:
+            ratelimit.training_limiter.release()
+
+
+def log_request_error(endpoint, error):
+    """
+    Count an unhandled request exception and log it with its traceback
+    """
+    metrics.inc('request_errors_total', endpoint=endpoint)
+    print(f"Error in {endpoint}: {str(error)}")
+    traceback.print_exc()
+
 
 @app.route('/')
 def index():
     """
     Homepage route - displays the main form for crop price prediction
     """
-    last_updated = get_last_updated_date()
+    # The page only changes with the data (last updated date) and the date range (daily)
+    etag = page_etag('index', datetime.now().date())
+    cached = http_cache.not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    with metrics.timed('get_last_updated_date'):
+        last_updated = get_last_updated_date()
     # Set date range for date picker (today to 1 year ahead)
     today = datetime.now().date()
     max_date = (datetime.now() + timedelta(days=365)).date()
     min_date_str = today.strftime('%Y-%m-%d')
     max_date_str = max_date.strftime('%Y-%m-%d')
     
-    return render_template('index.html', 
-                         districts=KARNATAKA_DISTRICTS,
-                         crops=VALID_CROPS,
-                         min_date=min_date_str,
-                         max_date=max_date_str,
-                         last_updated=last_updated)
+    with metrics.timed('render_template'):
+        html = render_template('index.html', 
+                             districts=KARNATAKA_DISTRICTS,
+                             crops=VALID_CROPS,
+                             min_date=min_date_str,
+                             max_date=max_date_str,
+                             last_updated=last_updated)
+    return http_cache.set_validators(Response(html, mimetype='text/html'), etag,
+                                     cache_control='no-cache')
 
 
 @app.route('/predict', methods=['POST'])
@@ -93,44 +341,61 @@ def predict():
                                  error_message="Invalid date format. Please select a valid date.")
         
         # Ensure model is trained
-        train_model_if_needed()
+        ensure_model_trained()
         
-        # Load model and make prediction
-        model_path = os.path.join('model', 'trained_model.pkl')
-        if not os.path.exists(model_path):
+        # Load model
+        with metrics.timed('load_model'):
+            model, feature_names = load_model()
+        if model is None:
+            metrics.inc('prediction_failures_total', endpoint='predict', reason='model_missing')
             return render_template('error.html', 
                                  error_message="Model not found. Please train the model first.")
         
         # Make prediction
-        predicted_price = predict_price(crop, district, selected_date)
+        with metrics.timed('predict_price'):
+            predicted_price = predict_price(crop, district, selected_date, model, feature_names)
         
         if predicted_price is None:
+            metrics.inc('prediction_failures_total', endpoint='predict', reason='predict_failed')
             return render_template('error.html', 
                                  error_message="Prediction failed. Please try again or contact support.")
+        monitor.record_forecasts([(crop, district, selected_date, predicted_price)])
         
         # Get historical data for graph
-        historical_data = get_historical_data(crop, district)
+        with metrics.timed('get_historical_data'):
+            historical_data = get_historical_data(crop, district, max_points=CHART_MAX_POINTS)
         
-        # Generate trend graph
-        graph_url = generate_trend_graph(historical_data, crop, district, selected_date, predicted_price)
+        # Generate trend graph; when chart rendering is saturated, show the prediction without it
+        graph_url = None
+        with metrics.timed('generate_trend_graph'):
+            if ratelimit.chart_limiter.try_acquire():
+                try:
+                    graph_url = generate_trend_graph(historical_data, crop, district, selected_date, predicted_price)
+                finally:
+                    ratelimit.chart_limiter.release()
         
         # Get last updated date
-        last_updated = get_last_updated_date()
+        with metrics.timed('get_last_updated_date'):
+            last_updated = get_last_updated_date()
         
         # Format date for display
         formatted_date = selected_date.strftime('%B %d, %Y')
         
-        return render_template('result.html',
-                             crop=crop,
-                             district=district,
-                             date=formatted_date,
-                             date_raw=date_str,
-                             predicted_price=round(predicted_price, 2),
-                             graph_url=graph_url,
-                             last_updated=last_updated,
-                             price_value=round(predicted_price, 2))
+        with metrics.timed('render_template'):
+            return render_template('result.html',
+                                 crop=crop,
+                                 district=district,
+                                 date=formatted_date,
+                                 date_raw=date_str,
+                                 predicted_price=round(predicted_price, 2),
+                                 graph_url=graph_url,
+                                 last_updated=last_updated,
+                                 price_value=round(predicted_price, 2))
     
+    except ratelimit.Overloaded as e:
+        return busy_response(503, str(e), e.retry_after)
     except Exception as e:
+        log_request_error('predict', e)
         return render_template('error.html', 
                              error_message=f"An error occurred: {str(e)}. Please try again.")
 
@@ -148,7 +413,9 @@ def generate_trend_graph(historical_data, crop, district, selected_date, predict
             dates = pd.to_datetime(historical_data['Date'])
             prices = historical_data['Price']
             
-            plt.plot(dates, prices, 'b-', linewidth=2, label='Historical Prices', marker='o', markersize=4)
+            # Markers only help while the points are few enough to tell apart
+            marker = 'o' if len(historical_data) <= CHART_MARKER_MAX_POINTS else None
+            plt.plot(dates, prices, 'b-', linewidth=2, label='Historical Prices', marker=marker, markersize=4)
         
         # Add predicted price point
         pred_date = pd.to_datetime(selected_date)
@@ -172,58 +439,241 @@ def generate_trend_graph(historical_data, crop, district, selected_date, predict
         return f"data:image/png;base64,{plot_url}"
     
     except Exception as e:
+        metrics.inc('request_errors_total', endpoint='generate_trend_graph')
         print(f"Error generating graph: {str(e)}")
         return None
 
 
-@app.route('/api/predict', methods=['POST'])
+def parse_api_request(data):
+    """
+    Validate the JSON body of an API prediction request
+    Returns (crop, district, date_str, selected_date)
+    Raises ValueError with a client-facing message if the input is invalid
+    """
+    data = data or {}
+    crop = data.get('crop', '').strip()
+    district = data.get('district', '').strip()
+    date_str = data.get('date', '').strip()
+    
+    # Validate inputs
+    if crop not in VALID_CROPS:
+        raise ValueError('Invalid crop')
+    
+    if district not in KARNATAKA_DISTRICTS:
+        raise ValueError('Invalid district')
+    
+    if not date_str:
+        raise ValueError('Invalid date')
+    
+    # Parse date
+    try:
+        selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD')
+    
+    return crop, district, date_str, selected_date
+
+
+def format_api_prediction(crop, district, date_str, selected_date, predicted_price, last_updated):
+    """
+    Build the JSON body returned for a successful API prediction
+    """
+    return {
+        'crop': crop,
+        'district': district,
+        'date': date_str,
+        'formatted_date': selected_date.strftime('%B %d, %Y'),
+        'predicted_price': round(predicted_price, 2),
+        'unit': '₹ per quintal',
+        'last_updated': last_updated
+    }
+
+
+@app.route('/api/predict', methods=['GET', 'POST'])
 def api_predict():
     """
     API endpoint for programmatic access to predictions
+    POST takes a JSON body; GET takes the same fields as query parameters and is cacheable
+    (the result only changes when a new model or dataset is published)
     Returns JSON response
     """
     try:
-        data = request.get_json()
-        crop = data.get('crop', '').strip()
-        district = data.get('district', '').strip()
-        date_str = data.get('date', '').strip()
-        
-        # Validate inputs
-        if crop not in VALID_CROPS:
-            return jsonify({'error': 'Invalid crop'}), 400
-        
-        if district not in KARNATAKA_DISTRICTS:
-            return jsonify({'error': 'Invalid district'}), 400
-        
-        if not date_str:
-            return jsonify({'error': 'Invalid date'}), 400
-        
-        # Parse date
         try:
-            selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        except ValueError:
-            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+            data = request.args if request.method == 'GET' else request.get_json()
+            crop, district, date_str, selected_date = parse_api_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Ensure model is trained
-        train_model_if_needed()
+        ensure_model_trained()
         
-        # Make prediction
-        predicted_price = predict_price(crop, district, selected_date)
+        if request.method == 'GET':
+            etag = page_etag('api_predict', crop, district, date_str)
+            last_modified = http_cache.snapshot_last_modified()
+            cached = http_cache.not_modified(etag, last_modified)
+            if cached is not None:
+                return cached
+        
+        # Load model and make prediction
+        with metrics.timed('load_model'):
+            model, feature_names = load_model()
+        with metrics.timed('predict_price'):
+            predicted_price = predict_price(crop, district, selected_date, model, feature_names)
         
         if predicted_price is None:
+            metrics.inc('prediction_failures_total', endpoint='api_predict', reason='predict_failed')
             return jsonify({'error': 'Prediction failed'}), 500
+        monitor.record_forecasts([(crop, district, selected_date, predicted_price)])
         
-        return jsonify({
-            'crop': crop,
-            'district': district,
-            'date': date_str,
-            'formatted_date': selected_date.strftime('%B %d, %Y'),
-            'predicted_price': round(predicted_price, 2),
-            'unit': '₹ per quintal',
-            'last_updated': get_last_updated_date()
-        })
+        with metrics.timed('get_last_updated_date'):
+            last_updated = get_last_updated_date()
+        
+        response = jsonify(format_api_prediction(crop, district, date_str, selected_date,
+                                                 predicted_price, last_updated))
+        if request.method == 'GET':
+            http_cache.set_validators(response, etag, last_modified,
+                                      f'public, max-age={API_CACHE_MAX_AGE}')
+        return response
+    
+    except ratelimit.Overloaded as e:
+        return busy_response(503, str(e), e.retry_after)
+    except Exception as e:
+        log_request_error('api_predict', e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/compare')
+def api_compare():
+    """
+    Compare a crop's prices across all districts for a month, ranked cheapest first
+    Query parameters: crop, month (YYYY-MM, default: current month),
+    by (forecast, current or historical; default: forecast), order (asc or desc)
+    Answered from the precomputed aggregate cube (see data/aggregates.py)
+    Returns JSON response
+    """
+    crop = request.args.get('crop', '').strip()
+    month = request.args.get('month', '').strip() or datetime.now().strftime('%Y-%m')
+    by = request.args.get('by', 'forecast')
+    order = request.args.get('order', 'asc')
+    
+    # Validate inputs
+    if crop not in VALID_CROPS:
+        return jsonify({'error': 'Invalid crop'}), 400
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return jsonify({'error': 'Invalid month format. Use YYYY-MM'}), 400
+    if by not in ('forecast', 'current', 'historical'):
+        return jsonify({'error': 'Invalid by. Use forecast, current or historical'}), 400
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'Invalid order. Use asc or desc'}), 400
+    
+    etag = page_etag('api_compare', crop, month, by, order, datetime.now().strftime('%Y-%m'))
+    cached = http_cache.not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    try:
+        with metrics.timed('compare_districts'):
+            ranking = aggregates.compare_districts(crop, month, by, descending=(order == 'desc'))
+            forecast_months = aggregates.get_cube()['forecast_months']
+    except Exception as e:
+        log_request_error('api_compare', e)
+        return jsonify({'error': str(e)}), 500
+    
+    response = jsonify({
+        'crop': crop,
+        'month': month,
+        'by': by,
+        'order': order,
+        'forecast_available': month in forecast_months,
+        'unit': '₹ per quintal',
+        'last_updated': get_last_updated_date(),
+        'districts': ranking
+    })
+    return http_cache.set_validators(response, etag, cache_control=f'public, max-age={API_CACHE_MAX_AGE}')
+
+
+@app.route('/api/history')
+def api_history():
+    """
+    Historical prices of a crop in a district
+    Query parameters: crop, district, start and end (YYYY-MM-DD, default: all data),
+    resample (D, W or M; default: every record, daily for ohlc), agg (mean, min, max or ohlc;
+    default: mean),
+    max_points (downsample to this many points, default and limit: HISTORY_MAX_POINTS)
+    Returns JSON response with one entry per point
+    """
+    crop = request.args.get('crop', '').strip()
+    district = request.args.get('district', '').strip()
+    start = request.args.get('start', '').strip() or None
+    end = request.args.get('end', '').strip() or None
+    frequency = request.args.get('resample', '').strip().upper() or None
+    agg = request.args.get('agg', 'mean').strip().lower()
+    
+    # Validate inputs
+    if crop not in VALID_CROPS:
+        return jsonify({'error': 'Invalid crop'}), 400
+    if district not in KARNATAKA_DISTRICTS:
+        return jsonify({'error': 'Invalid district'}), 400
+    try:
+        for value in (start, end):
+            if value is not None:
+                datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+    if frequency is not None and frequency not in history.RESAMPLE_FREQUENCIES:
+        return jsonify({'error': 'Invalid resample. Use D, W or M'}), 400
+    if agg not in history.AGGREGATIONS:
+        return jsonify({'error': 'Invalid agg. Use mean, min, max or ohlc'}), 400
+    try:
+        max_points = int(request.args.get('max_points', HISTORY_MAX_POINTS))
+    except ValueError:
+        return jsonify({'error': 'Invalid max_points'}), 400
+    if not 3 <= max_points <= HISTORY_MAX_POINTS:
+        return jsonify({'error': f'max_points must be between 3 and {HISTORY_MAX_POINTS}'}), 400
+    
+    etag = page_etag('api_history', crop, district, start, end, frequency, agg, max_points)
+    cached = http_cache.not_modified(etag)
+    if cached is not None:
+        return cached
+    
+    try:
+        with metrics.timed('query_history'):
+            points = history.query_history(crop, district, start, end, frequency, agg, max_points)
+    except Exception as e:
+        log_request_error('api_history', e)
+        return jsonify({'error': str(e)}), 500
+    if points is None:
+        return jsonify({'error': 'No historical data for this crop and district'}), 404
     
+    dates = points['Date'].astype(str).tolist()
+    columns = {name.lower(): values.round(2).tolist() for name, values in points.items() if name != 'Date'}
+    response = jsonify({
+        'crop': crop,
+        'district': district,
+        'start': start,
+        'end': end,
+        'resample': history.effective_frequency(frequency, agg),
+        'agg': agg,
+        'unit': '₹ per quintal',
+        'count': len(dates),
+        'points': [{'date': day, **dict(zip(columns, values))} for day, *values in zip(dates, *columns.values())]
+    })
+    return http_cache.set_validators(response, etag, cache_control=f'public, max-age={API_CACHE_MAX_AGE}')
+
+
+@app.route('/api/monitor')
+def api_monitor():
+    """
+    Data quality and model drift report of the monitor (see data/monitor.py)
+    Add details=1 for the running statistics of every crop and district
+    Returns JSON response
+    """
+    try:
+        return jsonify(monitor.get_report(details=request.args.get('details') == '1'))
     except Exception as e:
+        log_request_error('api_monitor', e)
         return jsonify({'error': str(e)}), 500
 
 
@@ -231,19 +681,143 @@ def api_predict():
 def update_data():
     """
     Manual trigger for daily data update (can be called by cron job or scheduler)
+    Requires the X-Admin-Token header when ADMIN_TOKEN is set
     """
+    if ADMIN_TOKEN and not is_admin_request():
+        return jsonify({'status': 'error', 'message': 'Admin token required'}), 403
     try:
-        update_daily_data()
-        train_model_if_needed(force_retrain=True)
+        with ratelimit.training_limiter.admit():
+            with metrics.timed('update_daily_data'):
+                update_daily_data()
+            # Check the new rows (and the current model's error on them) before retraining
+            try:
+                with metrics.timed('run_monitor'):
+                    monitor.run_monitor()
+            except Exception as e:
+                log_request_error('run_monitor', e)
+            metrics.inc('model_retrains_total', reason='manual_update')
+            with metrics.timed('train_model_if_needed'):
+                train_model_if_needed(force_retrain=True)
+        with metrics.timed('refresh_aggregates'):
+            aggregates.refresh()
         return jsonify({
             'status': 'success',
             'message': 'Data updated and model retrained',
             'last_updated': get_last_updated_date()
         })
+    except ratelimit.Overloaded as e:
+        return busy_response(503, str(e), e.retry_after)
     except Exception as e:
+        log_request_error('update_data', e)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus scrape endpoint with request, stage and model metrics
+    Under gunicorn the counters and histograms are summed over all workers
+    """
+    return Response(metrics.render_prometheus(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def warmup():
+    """
+    Import heavy libraries, train the model if needed and load it into memory ahead of
+    the first request
+    Called once in the gunicorn master (see gunicorn.conf.py) so forked workers share
+    the loaded modules and model copy-on-write, or at startup when run directly
+    Returns True if the model is loaded
+    """
+    with _warmup_lock:
+        if _startup['warmed_up']:
+            return is_model_loaded()
+        
+        started = time.perf_counter()
+        preload(pd, plt)
+        import sklearn.ensemble  # Needed to unpickle the model
+        
+        # Creates the sample dataset on a fresh deploy
+        get_last_updated_date()
+        
+        # Train before forking, so every worker starts with a model and is ready at once
+        # instead of the first request paying for training. Without preloading every worker
+        # warms up on its own; the training slot lets one of them train while the others
+        # wait and then find the model it published
+        try:
+            with ratelimit.training_limiter.admit(timeout=WARMUP_TRAINING_TIMEOUT):
+                train_model_if_needed()
+        except Exception as e:
+            print(f"Warning: Could not train model during warmup: {str(e)}")
+        load_model()
+        aggregates.get_cube()
+        history.get_series()
+        
+        _startup['warmup_seconds'] = time.perf_counter() - started
+        _startup['warmed_up'] = True
+        metrics.set_gauge('cold_start_seconds', _startup['warmup_seconds'], phase='warmup')
+        
+        # Move everything loaded so far out of the garbage collector's view so that
+        # collections in forked workers don't touch (and copy) the shared pages
+        gc.freeze()
+        
+        print(f"Warmup completed in {_startup['warmup_seconds']:.2f}s "
+              f"(model {'loaded' if is_model_loaded() else 'not available'})")
+        return is_model_loaded()
+
+
+@app.route('/healthz')
+def healthz():
+    """
+    Liveness check - answers as soon as the process can serve requests
+    """
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness check - returns 200 once the model is loaded in memory, 503 before
+    """
+    model_warm = is_model_loaded()
+    return jsonify({
+        'ready': model_warm,
+        'model_warm': model_warm,
+        'warmed_up': _startup['warmed_up'],
+        'import_seconds': _startup['import_seconds'],
+        'warmup_seconds': _startup['warmup_seconds']
+    }), 200 if model_warm else 503
+
+
+@app.route('/admin/profiles')
+def list_request_profiles():
+    """
+    List stored request profiles (admin only)
+    """
+    if not is_admin_request():
+        abort(403)
+    return jsonify({'profiles': profiler.list_profiles()})
+
+
+@app.route('/admin/profiles/<name>')
+def download_request_profile(name):
+    """
+    Download one stored request profile in collapsed-stack format (admin only)
+    """
+    if not is_admin_request():
+        abort(403)
+    path = profiler.get_profile_path(name)
+    if path is None:
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/plain', as_attachment=True, download_name=name)
+
+
+# Time spent importing this module (heavy libraries are deferred to warmup())
+_startup['import_seconds'] = time.perf_counter() - _IMPORT_STARTED
+metrics.set_gauge('cold_start_seconds', _startup['import_seconds'], phase='import')
+
+
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs('model', exist_ok=True)
@@ -252,9 +826,9 @@ if __name__ == '__main__':
     os.makedirs('static', exist_ok=True)
     os.makedirs('static/css', exist_ok=True)
     
-    # Train model if needed on startup
+    # Train model if needed and load it on startup
     print("Initializing application...")
-    train_model_if_needed()
+    warmup()
     
     # Start daily update scheduler in background thread
     try:
@@ -275,4 +849,3 @@ if __name__ == '__main__':
     print(f"Port: {port}")
     print("="*60 + "\n")
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
-
@@ -0,0 +1,368 @@
+"""
+ASGI Entry Point with Batched Predictions
+Serves POST /api/predict asynchronously: concurrent requests arriving within a short
+window are coalesced into a single vectorized model call. All other routes are passed
+to the Flask app through a small WSGI bridge.
+Usage: uvicorn asgi:app --host 0.0.0.0 --port 8000
+Benchmark against the sync path: python asgi.py
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+from urllib.parse import unquote
+
+import metrics
+import ratelimit
+import snapshots
+from app import (app as flask_app, parse_api_request, format_api_prediction, ensure_model_trained,
+                 warmup, rate_limiter, PROXY_COUNT)
+from model.predict import predict_prices, load_model
+from data.data_handler import get_last_updated_date
+from data import monitor
+
+
+# Largest number of requests answered by one model call
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '64'))
+
+# Longest time (milliseconds) the first request of a batch waits for others to join
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '5'))
+
+# Largest accepted request body (bytes)
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class PredictionBatcher:
+    """
+    Coalesces concurrent prediction requests into batches
+    predict_batch(items) runs in a worker thread and must return one result per item
+    """
+
+    def __init__(self, predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending = []
+        self._has_items = None
+        self._batch_full = None
+        self._task = None
+
+    def _ensure_started(self):
+        """
+        Start the batching loop on the running event loop (first call only)
+        """
+        if self._task is None or self._task.done():
+            self._has_items = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        """
+        Queue one item and wait for its result
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        """
+        Batching loop: wait for a first item, give others max_wait to join, run the batch
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            if not self._pending:
+                self._has_items.clear()
+            if len(self._pending) < self.max_batch_size:
+                self._batch_full.clear()
+
+            metrics.inc('prediction_batches_total')
+            metrics.inc('batched_predictions_total', len(batch))
+            try:
+                with metrics.timed('predict_batch'):
+                    results = await loop.run_in_executor(None, self.predict_batch, [i for i, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+def predict_batch(items):
+    """
+    Predict prices for a batch of (crop, district, date) items with one model call
+    Returns list of (predicted_price, last_updated) tuples (price is None on failure)
+    """
+    with snapshots.pinned():
+        ensure_model_trained()
+        model, feature_names = load_model()
+        prices = predict_prices(items, model, feature_names)
+        if prices is None:
+            prices = [None] * len(items)
+        monitor.record_forecasts((crop, district, selected_date, price)
+                                 for (crop, district, selected_date), price in zip(items, prices))
+        last_updated = get_last_updated_date()
+    return [(price, last_updated) for price in prices]
+
+
+batcher = PredictionBatcher(predict_batch)
+
+
+async def read_body(receive):
+    """
+    Read the full request body from an ASGI receive channel
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise ValueError('Request body too large')
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def send_json(send, status, payload, retry_after=None):
+    """
+    Send a JSON response
+    """
+    body = json.dumps(payload).encode('utf-8')
+    headers = [(b'content-type', b'application/json'),
+               (b'content-length', str(len(body)).encode('latin-1'))]
+    if retry_after is not None:
+        headers.append((b'retry-after', str(retry_after).encode('latin-1')))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def client_address(scope):
+    """
+    Address of the client, taken from X-Forwarded-For behind PROXY_COUNT trusted proxies
+    (the same entry ProxyFix uses for the Flask routes)
+    """
+    client = (scope.get('client') or ('', 0))[0]
+    if PROXY_COUNT > 0:
+        forwarded = [value.decode('latin-1') for name, value in scope.get('headers', [])
+                     if name == b'x-forwarded-for']
+        entries = [entry.strip() for entry in ','.join(forwarded).split(',') if entry.strip()]
+        if len(entries) >= PROXY_COUNT:
+            client = entries[-PROXY_COUNT]
+    return client
+
+
+async def api_predict(scope, receive, send):
+    """
+    Async version of POST /api/predict, answered through the batcher
+    """
+    started = time.perf_counter()
+    status = 500
+    try:
+        if rate_limiter is not None:
+            # The check may wait on the shared SQLite file; keep it off the event loop
+            retry_after = await asyncio.get_running_loop().run_in_executor(
+                None, rate_limiter.check, 'api_predict', client_address(scope))
+            if retry_after:
+                status = 429
+                await send_json(send, status, {'error': 'Too many requests', 'retry_after': retry_after},
+                                retry_after)
+                return
+
+        try:
+            data = json.loads(await read_body(receive) or b'null')
+            crop, district, date_str, selected_date = parse_api_request(data if isinstance(data, dict) else {})
+        except ValueError as e:
+            status = 400
+            await send_json(send, status, {'error': str(e)})
+            return
+
+        predicted_price, last_updated = await batcher.submit((crop, district, selected_date))
+        if predicted_price is None:
+            metrics.inc('prediction_failures_total', endpoint='api_predict_async', reason='predict_failed')
+            await send_json(send, status, {'error': 'Prediction failed'})
+            return
+
+        status = 200
+        await send_json(send, status, format_api_prediction(crop, district, date_str, selected_date,
+                                                            predicted_price, last_updated))
+    except ratelimit.Overloaded as e:
+        status = 503
+        await send_json(send, status, {'error': str(e), 'retry_after': e.retry_after}, e.retry_after)
+    except Exception as e:
+        metrics.inc('request_errors_total', endpoint='api_predict_async')
+        print(f"Error in api_predict_async: {str(e)}")
+        await send_json(send, 500, {'error': str(e)})
+    finally:
+        metrics.inc('requests_total', endpoint='api_predict_async', method='POST', status=status)
+        metrics.observe('request_duration_seconds', time.perf_counter() - started, endpoint='api_predict_async')
+
+
+def build_wsgi_environ(scope, body):
+    """
+    Build a WSGI environ dict from an ASGI HTTP scope
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    """
+    Run the Flask app for this request in a worker thread (WSGI bridge)
+    """
+    body = await read_body(receive)
+    environ = build_wsgi_environ(scope, body)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    def run():
+        result = flask_app(environ, start_response)
+        try:
+            return b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    content = await asyncio.get_running_loop().run_in_executor(None, run)
+    await send({
+        'type': 'http.response.start',
+        'status': response['status'],
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response['headers']]
+    })
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def lifespan(scope, receive, send):
+    """
+    Warm up the model on server startup
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, warmup)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    if scope['method'] == 'POST' and unquote(scope['path']) == '/api/predict':
+        await api_predict(scope, receive, send)
+    else:
+        await call_flask(scope, receive, send)
+
+
+def run_benchmark(requests=2000, concurrency=64):
+    """
+    Compare prediction throughput of the sync path (one model call per request,
+    handled by a thread pool) with the batched async path
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import date, timedelta
+    from app import VALID_CROPS, KARNATAKA_DISTRICTS
+    from model.predict import predict_price
+
+    ensure_model_trained()
+    model, feature_names = load_model()
+    items = [(VALID_CROPS[i % len(VALID_CROPS)], KARNATAKA_DISTRICTS[i % len(KARNATAKA_DISTRICTS)],
+              date.today() + timedelta(days=i % 365)) for i in range(requests)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda item: predict_price(*item, model, feature_names), items))
+    sync_seconds = time.perf_counter() - started
+
+    def predict_only(batch_items):
+        return predict_prices(batch_items, model, feature_names)
+
+    async def run_batched():
+        bench_batcher = PredictionBatcher(predict_only)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(item):
+            async with semaphore:
+                return await bench_batcher.submit(item)
+
+        return await asyncio.gather(*(one(item) for item in items))
+
+    started = time.perf_counter()
+    asyncio.run(run_batched())
+    batched_seconds = time.perf_counter() - started
+
+    print(f"Requests: {requests}, concurrency: {concurrency}, "
+          f"batch size <= {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS}ms")
+    print(f"Sync path:    {requests / sync_seconds:8.1f} predictions/s ({sync_seconds:.2f}s)")
+    print(f"Batched path: {requests / batched_seconds:8.1f} predictions/s ({batched_seconds:.2f}s)")
+    print(f"Speedup: {sync_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,198 @@
+"""
+Aggregate Cube Module
+Precomputed crop x district x month aggregates used to compare markets
+
+The cube holds, for every crop and district:
+- historical mean, minimum and maximum price per calendar month (over all years)
+- the latest recorded price
+- the model forecast for each of the next FORECAST_MONTHS months
+
+It is built once per data version, model version and calendar month and kept in memory,
+so comparisons across all districts are answered without scanning the dataset or calling
+the model. After an update or retrain the next access rebuilds it (refresh() does this
+right away in the process that published the new version).
+"""
+
+import threading
+from datetime import date
+import snapshots
+from lazy_import import lazy_import
+from data.data_handler import load_data, DATA_FILE
+from model.predict import load_model, predict_prices
+
+# pandas is imported on first use to keep application startup fast
+pd = lazy_import('pandas')
+
+# Number of months (starting with the current one) forecast in the cube
+FORECAST_MONTHS = 12
+
+# Day of the month used for monthly forecasts
+FORECAST_DAY = 15
+
+# Current cube: (key, cube)
+_cube_cache = (None, None)
+_cube_lock = threading.Lock()
+
+
+def _month_start(day):
+    """
+    First day of the month of a date
+    """
+    return day.replace(day=1)
+
+
+def _add_months(month, count):
+    """
+    First day of the month `count` months after `month`
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _cube_key(today=None):
+    """
+    Identify the inputs of the cube: data version, model version and current month
+    """
+    today = today or date.today()
+    return (snapshots.version_key('data', DATA_FILE),
+            snapshots.version_key('model', 'trained_model.pkl'),
+            _month_start(today))
+
+
+def build_cube(today=None):
+    """
+    Compute the aggregate cube from the dataset and the model
+    Returns dict with:
+        'history': {(crop, month_of_year): {district: {'mean', 'min', 'max', 'count'}}}
+        'latest': {crop: {district: {'price', 'date'}}}
+        'forecast': {(crop, 'YYYY-MM'): {district: price}}
+        'forecast_months': list of 'YYYY-MM' covered by forecasts
+        'built_at': ISO timestamp of the build
+    """
+    today = today or date.today()
+    df = load_data()
+    cube = {'history': {}, 'latest': {}, 'forecast': {}, 'forecast_months': []}
+    if df is None or len(df) == 0:
+        return cube
+
+    # Historical statistics per crop, district and calendar month
+    stats = (df.assign(MonthOfYear=df['Date'].dt.month)
+               .groupby(['Crop', 'District', 'MonthOfYear'])['Price']
+               .agg(['mean', 'min', 'max', 'count']))
+    for (crop, district, month), row in zip(stats.index, stats.itertuples(index=False)):
+        cube['history'].setdefault((crop, int(month)), {})[district] = {
+            'mean': round(float(row.mean), 2),
+            'min': round(float(row.min), 2),
+            'max': round(float(row.max), 2),
+            'count': int(row.count)
+        }
+
+    # Latest recorded price per crop and district
+    latest = df.sort_values('Date', kind='stable').groupby(['Crop', 'District']).tail(1)
+    for crop, district, day, price in zip(latest['Crop'], latest['District'], latest['Date'], latest['Price']):
+        cube['latest'].setdefault(crop, {})[district] = {
+            'price': round(float(price), 2),
+            'date': day.strftime('%Y-%m-%d')
+        }
+
+    # Forecasts for the coming months, all in one model call
+    model, feature_names = load_model()
+    if model is not None:
+        pairs = list(latest[['Crop', 'District']].itertuples(index=False, name=None))
+        months = [_add_months(_month_start(today), i) for i in range(FORECAST_MONTHS)]
+        items = [(crop, district, month.replace(day=FORECAST_DAY)) for month in months for crop, district in pairs]
+        prices = predict_prices(items, model, feature_names)
+        if prices is not None:
+            for (crop, district, day), price in zip(items, prices):
+                cube['forecast'].setdefault((crop, day.strftime('%Y-%m')), {})[district] = round(price, 2)
+            cube['forecast_months'] = [month.strftime('%Y-%m') for month in months]
+
+    return cube
+
+
+def get_cube():
+    """
+    Get the cube for the data and model versions the current request reads
+    Built on first use and whenever the data, the model or the month changes
+    """
+    global _cube_cache
+
+    with snapshots.pinned():
+        key = _cube_key()
+        cached_key, cube = _cube_cache
+        if cached_key == key:
+            return cube
+
+        with _cube_lock:
+            # Another thread may have built it while we waited
+            cached_key, cube = _cube_cache
+            if cached_key == key:
+                return cube
+            cube = build_cube()
+            _cube_cache = (key, cube)
+            return cube
+
+
+def refresh():
+    """
+    Rebuild the cube right away after new data or a new model was published
+    """
+    return get_cube()
+
+
+def compare_districts(crop, month, by='forecast', descending=False):
+    """
+    Rank all districts for a crop in a month, answered from the cube
+    month: 'YYYY-MM'; the historical statistics are those of its calendar month
+    by: 'forecast' (forecast price for the month), 'current' (latest recorded price)
+        or 'historical' (historical mean of the calendar month)
+    descending: Rank the highest price first (default: cheapest first)
+    Returns list of dicts, one per district, with rank, district and prices (None where unknown)
+    """
+    cube = get_cube()
+    month_of_year = int(month[5:7])
+    history = cube['history'].get((crop, month_of_year), {})
+    latest = cube['latest'].get(crop, {})
+    forecast = cube['forecast'].get((crop, month), {})
+
+    rows = []
+    for district in sorted(set(history) | set(latest) | set(forecast)):
+        stats = history.get(district, {})
+        current = latest.get(district, {})
+        rows.append({
+            'district': district,
+            'forecast_price': forecast.get(district),
+            'current_price': current.get('price'),
+            'current_date': current.get('date'),
+            'historical_mean': stats.get('mean'),
+            'historical_min': stats.get('min'),
+            'historical_max': stats.get('max'),
+            'historical_count': stats.get('count', 0)
+        })
+
+    sort_field = {'forecast': 'forecast_price', 'current': 'current_price',
+                  'historical': 'historical_mean'}[by]
+    known = [row for row in rows if row[sort_field] is not None]
+    unknown = [row for row in rows if row[sort_field] is None]
+    known.sort(key=lambda row: row[sort_field], reverse=descending)
+
+    ranked = known + unknown
+    for rank, row in enumerate(ranked, start=1):
+        row['rank'] = rank if row[sort_field] is not None else None
+    return ranked
+
+
+if __name__ == '__main__':
+    import time
+
+    started = time.perf_counter()
+    get_cube()
+    print(f"Built cube in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    month = date.today().strftime('%Y-%m')
+    started = time.perf_counter()
+    ranking = compare_districts('Arecanut', month)
+    print(f"Compared districts in {(time.perf_counter() - started) * 1000:.3f} ms")
+    for row in ranking[:5]:
+        print(f"{row['rank']:>2}. {row['district']:<18} forecast {row['forecast_price']} "
+              f"(historical mean {row['historical_mean']})")
@@ -0,0 +1,188 @@
+"""
+Backfill Module
+Finds missing (date, crop, district) price cells, e.g. after the server was down for a few
+days, and fills them in bulk through the ingest adapter, with one model retrain at the end
+
+Usage:
+    python -m data.backfill                      # fill from the data watermark up to today
+    python -m data.backfill --start 2024-01-01   # also look for holes since a given date
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+import pandas as pd
+import ratelimit
+from data.data_handler import load_data, append_data, initialize_sample_data
+from data.ingest import BulkFetcher, get_adapter, get_checkpoint_path, INGEST_MAX_WORKERS
+
+
+# Progress of the current backfill run, used to resume after an interruption
+BACKFILL_STATE_PATH = os.path.join('data', 'backfill_state.json')
+
+# Number of dates filled (and saved) per batch
+BACKFILL_BATCH_DAYS = int(os.environ.get('BACKFILL_BATCH_DAYS', '30'))
+
+# Seconds the final retrain waits for the training slot while the server is training
+BACKFILL_TRAINING_TIMEOUT = 3600
+
+
+def find_missing_cells(df, start_date, end_date, crops=None, districts=None):
+    """
+    Find (date, crop, district) cells without a price between start_date and end_date (inclusive)
+    crops, districts: Expected crops and districts (default: all present in the data)
+    Returns DataFrame with Date, Crop and District columns, sorted by date
+    """
+    if crops is None:
+        crops = sorted(df['Crop'].unique())
+    if districts is None:
+        districts = sorted(df['District'].unique())
+
+    dates = pd.date_range(start_date, end_date, freq='D')
+    expected = pd.MultiIndex.from_product([dates, crops, districts], names=['Date', 'Crop', 'District'])
+    present = pd.MultiIndex.from_frame(pd.DataFrame({
+        'Date': pd.to_datetime(df['Date']).dt.normalize(),
+        'Crop': df['Crop'],
+        'District': df['District']
+    }))
+    missing = expected.difference(present)
+    return missing.to_frame(index=False).sort_values(['Date', 'Crop', 'District'], ignore_index=True)
+
+
+def load_backfill_state():
+    """
+    Load the progress of an interrupted backfill run
+    Returns dict (empty if there is none)
+    """
+    try:
+        with open(BACKFILL_STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_backfill_state(state):
+    """
+    Persist backfill progress atomically
+    """
+    temp_path = f"{BACKFILL_STATE_PATH}.tmp.{os.getpid()}"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, BACKFILL_STATE_PATH)
+
+
+def clear_backfill_state():
+    """
+    Remove the progress file after a finished run
+    """
+    if os.path.exists(BACKFILL_STATE_PATH):
+        os.remove(BACKFILL_STATE_PATH)
+
+
+def fetch_cells(adapter, cells, label, max_workers=INGEST_MAX_WORKERS):
+    """
+    Fetch prices for a batch of cells, in one call if the adapter supports it,
+    otherwise concurrently through a BulkFetcher
+    Returns list of prices in the same order as cells (None where no price was reported)
+    """
+    if adapter.supports_batch:
+        return adapter.fetch_batch(cells)
+
+    fetcher = BulkFetcher(adapter, max_workers=max_workers, checkpoint_path=get_checkpoint_path(label))
+    results, failures = fetcher.fetch_all(cells)
+    if failures:
+        # Keep the checkpoint; the next run only fetches the failed cells
+        raise RuntimeError(f"Failed to fetch {len(failures)} of {len(cells)} prices, "
+                           f"e.g. {next(iter(failures.values()))}")
+    fetcher.clear_checkpoint()
+    return [results[cell] for cell in cells]
+
+
+def backfill_missing_data(start_date=None, end_date=None, batch_days=BACKFILL_BATCH_DAYS,
+                          adapter=None, retrain=True):
+    """
+    Fill missing price cells between start_date and end_date
+    start_date: First date to check (default: the data watermark, i.e. the latest date present,
+                so partially filled latest days are completed too)
+    end_date: Last date to check (default: today)
+    batch_days: Number of dates fetched and saved per batch; progress is saved after each
+                batch, so an interrupted run continues with the next batch
+    retrain: Retrain the model once at the end if any rows were added
+    Returns number of rows added
+    """
+    df = load_data()
+    if df is None:
+        initialize_sample_data()
+        df = load_data()
+
+    end_date = end_date or datetime.now().date()
+    start_date = start_date or df['Date'].max().date()
+
+    # Resume an interrupted run over the same range
+    state = load_backfill_state()
+    resume_from = start_date
+    if state.get('start') == str(start_date) and state.get('end') == str(end_date) and state.get('done_through'):
+        resume_from = datetime.strptime(state['done_through'], '%Y-%m-%d').date() + timedelta(days=1)
+        print(f"Resuming backfill after {state['done_through']}")
+
+    if resume_from > end_date:
+        print("Backfill: nothing to do")
+        clear_backfill_state()
+        return 0
+
+    missing = find_missing_cells(df, resume_from, end_date)
+    print(f"Backfill {resume_from} to {end_date}: {len(missing)} missing cells")
+
+    own_adapter = adapter is None
+    if own_adapter:
+        adapter = get_adapter(df)
+
+    rows_added = 0
+    try:
+        batch_start = resume_from
+        while batch_start <= end_date:
+            batch_end = min(batch_start + timedelta(days=batch_days - 1), end_date)
+            batch = missing[(missing['Date'] >= pd.Timestamp(batch_start)) &
+                            (missing['Date'] <= pd.Timestamp(batch_end))]
+
+            if len(batch) > 0:
+                cells = list(zip(batch['Date'].dt.strftime('%Y-%m-%d'), batch['Crop'], batch['District']))
+                prices = fetch_cells(adapter, cells, f"backfill-{batch_start}-{batch_end}")
+
+                new_df = batch.assign(Price=prices).dropna(subset=['Price']).astype({'Price': float})
+                added = append_data(new_df, sort=True) if len(new_df) > 0 else 0
+                rows_added += added
+                print(f"  {batch_start} to {batch_end}: added {added} of {len(batch)} cells")
+
+            save_backfill_state({'start': str(start_date), 'end': str(end_date), 'done_through': str(batch_end)})
+            batch_start = batch_end + timedelta(days=1)
+    finally:
+        if own_adapter:
+            adapter.close()
+
+    clear_backfill_state()
+    print(f"Backfill completed: {rows_added} rows added")
+
+    if retrain and rows_added > 0:
+        # Imported here because it pulls in scikit-learn, which is slow to import
+        from model.train_model_if_needed import train_model_if_needed
+        with ratelimit.training_limiter.admit(timeout=BACKFILL_TRAINING_TIMEOUT):
+            train_model_if_needed(force_retrain=True)
+
+    return rows_added
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    parser = argparse.ArgumentParser(description='Fill missing crop price data')
+    parser.add_argument('--start', type=parse_date, help='First date to check (default: latest date in the data)')
+    parser.add_argument('--end', type=parse_date, help='Last date to check (default: today)')
+    parser.add_argument('--batch-days', type=int, default=BACKFILL_BATCH_DAYS, help='Dates per batch')
+    parser.add_argument('--no-retrain', action='store_true', help='Do not retrain the model afterwards')
+    args = parser.parse_args()
+
+    backfill_missing_data(args.start, args.end, args.batch_days, retrain=not args.no_retrain)
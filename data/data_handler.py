@@ -4,17 +4,136 @@ Manages loading, updating, and retrieving crop price data
 """
 
 import os
-import pandas as pd
-import numpy as np
+import json
 from datetime import datetime, timedelta
 import random
+import snapshots
+from lazy_import import lazy_import
+
+# pandas is imported on first use to keep application startup fast
+pd = lazy_import('pandas')
+
+
+# File names inside a data snapshot
+DATA_FILE = 'crop_price_data.csv'
+WATERMARK_FILE = 'watermark.json'
+
+# Dataset of the most recently loaded snapshot: (version, DataFrame)
+_data_cache = (None, None)
 
 
 def get_data_path():
     """
-    Get path to data CSV file
+    Get path to data CSV file (in the data snapshot this request reads, see snapshots.py)
+    """
+    return snapshots.snapshot_path('data', DATA_FILE)
+
+
+def get_watermark_path():
+    """
+    Get path to the watermark file (latest data date, kept next to the CSV)
+    """
+    return snapshots.snapshot_path('data', WATERMARK_FILE)
+
+
+def save_data(df):
+    """
+    Publish the full dataset as a new data snapshot
+    The CSV and its watermark are written to a staging directory that is then published
+    atomically, so readers and an interrupted update never see a half-written file
+    Returns the new data version
+    """
+    staging_dir = snapshots.create_staging('data')
+    data_path = os.path.join(staging_dir, DATA_FILE)
+    df.to_csv(data_path, index=False)
+    
+    latest_date = pd.to_datetime(df['Date']).max()
+    _write_watermark(latest_date.strftime('%Y-%m-%d'), data_path, os.path.join(staging_dir, WATERMARK_FILE))
+    return snapshots.publish('data', staging_dir)
+
+
+def append_data(new_df, sort=False):
+    """
+    Append rows to the current dataset and publish it as a new data snapshot
+    The current version is loaded, extended and published under the data writer lock, so
+    rows added concurrently by another writer (e.g. /update during a backfill) are kept.
+    Rows for a (date, crop, district) that is already present are skipped
+    sort: Sort the result by date, crop and district
+    Returns number of rows added
     """
-    return os.path.join('data', 'crop_price_data.csv')
+    with snapshots.writer_lock('data'):
+        df = load_data()
+        if df is None:
+            initialize_sample_data()
+            df = load_data()
+        
+        keys = ['Date', 'Crop', 'District']
+        existing = pd.MultiIndex.from_frame(df[keys])
+        new_df = new_df[~pd.MultiIndex.from_frame(new_df[keys]).isin(existing)]
+        if len(new_df) == 0:
+            return 0
+        
+        df = pd.concat([df, new_df], ignore_index=True)
+        if sort:
+            df = df.sort_values(keys, kind='stable', ignore_index=True)
+        save_data(df)
+        return len(new_df)
+
+
+def _data_file_signature(data_path):
+    """
+    Identify a CSV file by modification time and size
+    Returns None if the file does not exist
+    """
+    try:
+        stat = os.stat(data_path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _write_watermark(latest_date, data_path, watermark_path):
+    """
+    Record the latest data date together with the CSV file it was computed from
+    """
+    watermark = {'latest_date': latest_date, 'data_file': _data_file_signature(data_path)}
+    temp_path = f"{watermark_path}.tmp.{os.getpid()}"
+    with open(temp_path, 'w') as f:
+        json.dump(watermark, f)
+    os.replace(temp_path, watermark_path)
+
+
+def get_data_watermark():
+    """
+    Get the latest date present in the data without loading the whole dataset
+    Uses the watermark file when it matches the current CSV, otherwise reads only the Date column
+    Returns a date, or None if there is no data
+    """
+    data_path = get_data_path()
+    watermark_path = get_watermark_path()
+    signature = _data_file_signature(data_path)
+    if signature is None:
+        return None
+    
+    try:
+        with open(watermark_path) as f:
+            watermark = json.load(f)
+        if watermark.get('data_file') == signature:
+            return datetime.strptime(watermark['latest_date'], '%Y-%m-%d').date()
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    try:
+        dates = pd.read_csv(data_path, usecols=['Date'])['Date']
+        latest_date = pd.to_datetime(dates).max()
+    except Exception as e:
+        print(f"Error reading data watermark: {str(e)}")
+        return None
+    if pd.isna(latest_date):
+        return None
+    
+    _write_watermark(latest_date.strftime('%Y-%m-%d'), data_path, watermark_path)
+    return latest_date.date()
 
 
 def initialize_sample_data():
@@ -95,40 +214,60 @@ def initialize_sample_data():
     df = pd.DataFrame(data_records)
     
     # Save to CSV
-    os.makedirs('data', exist_ok=True)
-    df.to_csv(data_path, index=False)
+    save_data(df)
     print(f"Sample data initialized with {len(df)} records")
 
 
 def load_data():
     """
     Load data from CSV file
+    The dataset of a published snapshot never changes, so it is kept in memory and shared
+    between callers until a new snapshot is published; callers must not modify it in place
     Returns pandas DataFrame
     """
+    global _data_cache
+    
     data_path = get_data_path()
     
     # Initialize sample data if needed
     if not os.path.exists(data_path):
         initialize_sample_data()
+        data_path = get_data_path()
+    
+    version = snapshots.resolve('data')
+    cached_version, cached_df = _data_cache
+    if version is not None and cached_version == version:
+        return cached_df
     
     try:
         df = pd.read_csv(data_path)
         df['Date'] = pd.to_datetime(df['Date'])
-        return df
     except Exception as e:
         print(f"Error loading data: {str(e)}")
         return None
+    
+    if version is not None:
+        _data_cache = (version, df)
+    return df
 
 
-def update_daily_data():
+def update_daily_data(adapter=None, max_workers=None):
     """
     Update data with latest daily prices
-    Simulates fetching new data from Agmarknet API
-    In production, this would fetch from actual API
+    Prices are fetched for every crop and district through an ingest adapter (see data/ingest.py,
+    simulated Agmarknet prices by default; set INGEST_ADAPTER to 'file' or 'http' for a real feed)
+    Adapters that support batch requests fetch all cells in one call; otherwise cells are
+    fetched concurrently and checkpointed, so an interrupted or partly failed update only
+    fetches the missing cells when run again
+    adapter: Ingest adapter to use (default: the configured one)
+    max_workers: Number of concurrent fetches (default: INGEST_MAX_WORKERS)
+    Returns number of rows added (nothing is saved if the feed had no new prices)
     """
-    print("Updating daily data...")
+    # Imported here because data.backfill imports this module
+    from data.backfill import fetch_cells
+    from data.ingest import get_adapter, INGEST_MAX_WORKERS
     
-    data_path = get_data_path()
+    print("Updating daily data...")
     
     # Load existing data
     df = load_data()
@@ -138,76 +277,65 @@ def update_daily_data():
     
     # Get today's date
     today = datetime.now().date()
+    today_str = today.strftime('%Y-%m-%d')
     
     # Check if today's data already exists
-    df['Date'] = pd.to_datetime(df['Date'])
     latest_date = df['Date'].max().date()
     
     if latest_date >= today:
         print("Data is already up to date")
-        return
+        return 0
     
-    # Generate new data for today
+    # Fetch new prices for today
     districts = df['District'].unique()
     crops = df['Crop'].unique()
+    cells = [(today_str, crop, district) for crop in crops for district in districts]
     
-    new_records = []
-    for crop in crops:
-        for district in districts:
-            # Get recent average price for this crop-district combination
-            recent_data = df[(df['Crop'] == crop) & 
-                           (df['District'] == district) &
-                           (df['Date'] >= (datetime.now() - timedelta(days=30)).date())]
-            
-            if len(recent_data) > 0:
-                base_price = recent_data['Price'].mean()
-            else:
-                # Fallback to overall average
-                base_price = df[df['Crop'] == crop]['Price'].mean()
-            
-            # Add small random variation for daily update
-            price = base_price * (1.0 + random.uniform(-0.05, 0.05))
-            
-            new_records.append({
-                'Date': today.strftime('%Y-%m-%d'),
-                'Crop': crop,
-                'District': district,
-                'Price': round(price, 2)
-            })
-    
-    # Append new records
-    new_df = pd.DataFrame(new_records)
-    df = pd.concat([df, new_df], ignore_index=True)
-    
-    # Save updated data
-    df.to_csv(data_path, index=False)
-    print(f"Updated data with {len(new_records)} new records for {today}")
+    own_adapter = adapter is None
+    if own_adapter:
+        adapter = get_adapter(df)
+    try:
+        prices = fetch_cells(adapter, cells, today_str, max_workers=max_workers or INGEST_MAX_WORKERS)
+    finally:
+        if own_adapter:
+            adapter.close()
+    
+    new_records = [
+        {'Date': date_str, 'Crop': crop, 'District': district, 'Price': round(price, 2)}
+        for (date_str, crop, district), price in zip(cells, prices)
+        if price is not None
+    ]
+    
+    # Publishing an unchanged dataset would only invalidate every cache built on it
+    if not new_records:
+        print(f"No new prices reported for {today} ({adapter.name} adapter)")
+        return 0
+    
+    # Append new records to the current version (another writer may have published since)
+    new_df = pd.DataFrame(new_records, columns=['Date', 'Crop', 'District', 'Price'])
+    new_df['Date'] = pd.to_datetime(new_df['Date'])
+    rows_added = append_data(new_df)
+    print(f"Updated data with {rows_added} new records for {today} "
+          f"({adapter.name} adapter)")
+    return rows_added
 
 
-def get_historical_data(crop, district, days=365):
+def get_historical_data(crop, district, days=365, max_points=None):
     """
     Get historical price data for a specific crop and district
+    days: Number of days up to today to include
+    max_points: Downsample to at most this many points (see data/history.py)
     Returns DataFrame with Date and Price columns
     """
-    df = load_data()
-    if df is None:
-        return None
+    from data.history import query_history
     
-    # Filter data
-    filtered = df[(df['Crop'] == crop) & (df['District'] == district)].copy()
-    
-    if len(filtered) == 0:
+    # Last N days (dates are whole days, so the day N days ago is not included)
+    start = (datetime.now() - timedelta(days=days - 1)).date()
+    history = query_history(crop, district, start=start, max_points=max_points)
+    if history is None:
         return None
     
-    # Sort by date
-    filtered = filtered.sort_values('Date')
-    
-    # Get last N days
-    cutoff_date = datetime.now() - timedelta(days=days)
-    filtered = filtered[filtered['Date'] >= cutoff_date]
-    
-    # Return only Date and Price columns
-    return filtered[['Date', 'Price']].reset_index(drop=True)
+    return pd.DataFrame({'Date': pd.to_datetime(history['Date']), 'Price': history['Price']})
 
 
 def get_last_updated_date():
@@ -215,15 +343,14 @@ def get_last_updated_date():
     Get the last updated date of the data
     Returns formatted date string
     """
-    df = load_data()
-    if df is None:
-        return "N/A"
+    # Initialize sample data if needed
+    if not os.path.exists(get_data_path()):
+        initialize_sample_data()
     
-    try:
-        latest_date = df['Date'].max()
-        return latest_date.strftime('%Y-%m-%d')
-    except:
+    latest_date = get_data_watermark()
+    if latest_date is None:
         return "N/A"
+    return latest_date.strftime('%Y-%m-%d')
 
 
 if __name__ == '__main__':
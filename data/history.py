@@ -0,0 +1,225 @@
+"""
+Historical Price Queries
+Arbitrary date ranges, resampling and downsampling of the price history of a crop and district
+
+For every data version the dataset is sorted once by crop, district and date into two
+read-only arrays (dates and prices); each crop/district is a contiguous range of them.
+A query finds its date range by binary search and returns views of those arrays, so
+plain range queries copy nothing. Resampling and downsampling create new (small) arrays.
+"""
+
+import threading
+import snapshots
+from lazy_import import lazy_import
+from data.data_handler import load_data, DATA_FILE
+
+# NumPy is imported on first use to keep application startup fast
+np = lazy_import('numpy')
+
+
+# Supported resampling frequencies: daily, weekly (weeks start on Monday), monthly
+RESAMPLE_FREQUENCIES = ('D', 'W', 'M')
+
+# Supported aggregations of resampled buckets
+AGGREGATIONS = ('mean', 'min', 'max', 'ohlc')
+
+# Current series index: (data version, (dates, prices, {(crop, district): (start, stop)}))
+_series_cache = (None, None)
+_series_lock = threading.Lock()
+
+
+def _build_series(df):
+    """
+    Sort the dataset once by crop, district and date
+    Returns (dates, prices, ranges) with read-only datetime64[D] and float64 arrays and
+    the (start, stop) positions of every crop and district
+    """
+    ordered = df.sort_values(['Crop', 'District', 'Date'], kind='stable')
+    dates = ordered['Date'].to_numpy().astype('datetime64[D]')
+    prices = ordered['Price'].to_numpy(dtype=np.float64, copy=True)
+    dates.flags.writeable = False
+    prices.flags.writeable = False
+
+    ranges = {}
+    stop = 0
+    for key, size in ordered.groupby(['Crop', 'District'], sort=False).size().items():
+        ranges[key] = (stop, stop + int(size))
+        stop += int(size)
+    return dates, prices, ranges
+
+
+def get_series():
+    """
+    Series index of the data version the current request reads, built on first use
+    """
+    global _series_cache
+
+    key = snapshots.version_key('data', DATA_FILE)
+    cached_key, series = _series_cache
+    if cached_key == key:
+        return series
+
+    with _series_lock:
+        cached_key, series = _series_cache
+        if cached_key == key:
+            return series
+        df = load_data()
+        if df is None:
+            return None
+        series = _build_series(df)
+        _series_cache = (key, series)
+        return series
+
+
+def _bucket_keys(dates, frequency):
+    """
+    Start date of the resampling bucket of every date
+    """
+    if frequency == 'D':
+        return dates
+    if frequency == 'W':
+        days = dates.astype(np.int64)
+        # 1970-01-01 was a Thursday; shift so that weeks start on Monday
+        return (days - (days + 3) % 7).astype('datetime64[D]')
+    return dates.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def resample(dates, prices, frequency, agg='mean'):
+    """
+    Aggregate sorted prices into daily, weekly or monthly buckets
+    Returns dict with 'Date' (bucket start) and 'Price', or 'Open', 'High', 'Low', 'Close'
+    for agg='ohlc'
+    """
+    keys = _bucket_keys(dates, frequency)
+    if len(keys) == 0:
+        empty = np.array([], dtype=np.float64)
+        if agg == 'ohlc':
+            return {'Date': keys, 'Open': empty, 'High': empty, 'Low': empty, 'Close': empty}
+        return {'Date': keys, 'Price': empty}
+
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    bucket_dates = keys[starts]
+    if agg == 'mean':
+        counts = np.diff(np.append(starts, len(prices)))
+        return {'Date': bucket_dates, 'Price': np.add.reduceat(prices, starts) / counts}
+    if agg == 'min':
+        return {'Date': bucket_dates, 'Price': np.minimum.reduceat(prices, starts)}
+    if agg == 'max':
+        return {'Date': bucket_dates, 'Price': np.maximum.reduceat(prices, starts)}
+    ends = np.append(starts[1:], len(prices)) - 1
+    return {
+        'Date': bucket_dates,
+        'Open': prices[starts],
+        'High': np.maximum.reduceat(prices, starts),
+        'Low': np.minimum.reduceat(prices, starts),
+        'Close': prices[ends]
+    }
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: choose `threshold` points that keep the
+    visual shape of the series (peaks and dips survive, unlike with plain decimation)
+    x, y: Numeric arrays of equal length, x sorted
+    Returns array of indices into x and y (always including the first and last point)
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # Bucket boundaries for the points between the first and the last one
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        if i + 2 < len(edges):
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+            avg_x = x[next_start:next_stop].mean()
+            avg_y = y[next_start:next_stop].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+
+        # Point of this bucket forming the largest triangle with the previous point and the average
+        area = np.abs((x[previous] - avg_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def effective_frequency(frequency, agg):
+    """
+    Resampling frequency a query actually uses: OHLC needs buckets, so it is daily by default
+    """
+    if agg == 'ohlc' and frequency is None:
+        return 'D'
+    return frequency
+
+
+def query_history(crop, district, start=None, end=None, frequency=None, agg='mean', max_points=None):
+    """
+    Price history of a crop and district
+    start, end: First and last date to include (dates or 'YYYY-MM-DD'; default: all data)
+    frequency: Resample to 'D' (daily), 'W' (weekly) or 'M' (monthly); None keeps every record
+    agg: Aggregation of resampled buckets: 'mean', 'min', 'max' or 'ohlc'
+    max_points: Downsample to at most this many points with LTTB
+    Returns dict of NumPy arrays: 'Date' (datetime64[D]) plus 'Price', or 'Open', 'High',
+    'Low', 'Close' for agg='ohlc'. Without resampling and downsampling the arrays are
+    read-only views of the cached series. Returns None if there is no data for the crop and district
+    """
+    if frequency is not None and frequency not in RESAMPLE_FREQUENCIES:
+        raise ValueError(f"Invalid frequency {frequency!r}, use one of {', '.join(RESAMPLE_FREQUENCIES)}")
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Invalid aggregation {agg!r}, use one of {', '.join(AGGREGATIONS)}")
+    frequency = effective_frequency(frequency, agg)
+
+    with snapshots.pinned():
+        series = get_series()
+    if series is None:
+        return None
+    all_dates, all_prices, ranges = series
+    if (crop, district) not in ranges:
+        return None
+
+    first, last = ranges[(crop, district)]
+    dates = all_dates[first:last]
+    prices = all_prices[first:last]
+
+    # Date range by binary search on the sorted dates
+    lower = 0 if start is None else int(np.searchsorted(dates, np.datetime64(start, 'D'), side='left'))
+    upper = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(end, 'D'), side='right'))
+    dates = dates[lower:upper]
+    prices = prices[lower:upper]
+
+    if frequency is not None:
+        result = resample(dates, prices, frequency, agg)
+    else:
+        result = {'Date': dates, 'Price': prices}
+
+    if max_points is not None and len(result['Date']) > max_points:
+        value_column = 'Close' if agg == 'ohlc' else 'Price'
+        indices = lttb_indices(result['Date'].astype(np.int64), result[value_column], max_points)
+        result = {column: values[indices] for column, values in result.items()}
+    return result
+
+
+if __name__ == '__main__':
+    import time
+    from datetime import date, timedelta
+
+    query_history('Coconut', 'Mysuru')
+    started = time.perf_counter()
+    history = query_history('Coconut', 'Mysuru', start=date.today() - timedelta(days=730))
+    print(f"Range query: {len(history['Date'])} points in {(time.perf_counter() - started) * 1000:.3f} ms "
+          f"(view: {history['Price'].base is not None})")
+
+    monthly = query_history('Coconut', 'Mysuru', frequency='M', agg='ohlc')
+    for row in zip(*(monthly[column][-3:] for column in ('Date', 'Open', 'High', 'Low', 'Close'))):
+        print(row)
@@ -0,0 +1,445 @@
+"""
+Ingest Module
+Pluggable adapters for fetching daily mandi prices, and a bulk fetcher that pulls many
+(crop, district) prices concurrently with retries and a resumable checkpoint
+
+Adapters:
+- SimulatedAdapter: generates prices from recent averages (default, no network needed)
+- FileFeedAdapter: reads prices from a local CSV feed (Date, Crop, District, Price)
+- HttpFeedAdapter: fetches prices from an HTTP feed, one keep-alive connection per worker
+
+A stand-in HTTP feed for offline testing can be started with:
+    python -m data.ingest serve --port 8765 --latency-ms 50
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import http.client
+from datetime import datetime
+from urllib.parse import urlsplit, urlencode, parse_qs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from lazy_import import lazy_import
+
+# pandas and NumPy are imported on first use to keep application startup fast
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+
+# Adapter used by update_daily_data: 'simulated', 'file' or 'http'
+INGEST_ADAPTER = os.environ.get('INGEST_ADAPTER', 'simulated')
+
+# CSV feed read by FileFeedAdapter
+INGEST_FEED_PATH = os.environ.get('INGEST_FEED_PATH', os.path.join('data', 'feed.csv'))
+
+# Base URL of the HTTP feed used by HttpFeedAdapter
+INGEST_FEED_URL = os.environ.get('INGEST_FEED_URL', 'http://127.0.0.1:8765')
+
+# Number of prices fetched concurrently
+INGEST_MAX_WORKERS = int(os.environ.get('INGEST_MAX_WORKERS', '16'))
+
+
+class FetchError(Exception):
+    """
+    Raised by adapters when a price could not be fetched (the fetch may be retried)
+    """
+
+
+class IngestAdapter:
+    """
+    Base class for price feed adapters
+    fetch() returns the price for one (date, crop, district) cell, or None if the market
+    did not report a price for that day. It must be safe to call from several threads.
+    """
+
+    name = 'base'
+
+    # True if fetch_batch() answers many cells at once (otherwise cells are fetched one by one)
+    supports_batch = False
+
+    def fetch(self, date_str, crop, district):
+        raise NotImplementedError
+
+    def fetch_batch(self, cells):
+        """
+        Fetch many (date, crop, district) cells at once
+        Returns list of prices in the same order (None where no price was reported)
+        """
+        return [self.fetch(*cell) for cell in cells]
+
+    def close(self):
+        """
+        Release resources (connections, files)
+        """
+
+
+class SimulatedAdapter(IngestAdapter):
+    """
+    Simulates fetching from the Agmarknet API: the recent 30-day average price of each
+    crop and district with a small random daily variation
+    """
+
+    name = 'simulated'
+    supports_batch = True
+
+    def __init__(self, df, window_days=30, variation=0.05):
+        dates = pd.to_datetime(df['Date'])
+        recent = df[dates >= dates.max() - pd.Timedelta(days=window_days)]
+        self.recent_series = recent.groupby(['Crop', 'District'])['Price'].mean()
+        self.recent_means = self.recent_series.to_dict()
+        self.crop_means = df.groupby('Crop')['Price'].mean().to_dict()
+        self.variation = variation
+
+    def base_price(self, crop, district):
+        """
+        Recent average price for a crop and district (falls back to the crop average)
+        """
+        base_price = self.recent_means.get((crop, district))
+        if base_price is None:
+            base_price = self.crop_means.get(crop)
+        return base_price
+
+    def fetch(self, date_str, crop, district):
+        base_price = self.base_price(crop, district)
+        if base_price is None:
+            return None
+        # Add small random variation for daily update
+        return round(base_price * (1.0 + random.uniform(-self.variation, self.variation)), 2)
+
+    def fetch_batch(self, cells):
+        """
+        Vectorized version of fetch() for many cells
+        """
+        if len(cells) == 0:
+            return []
+        frame = pd.DataFrame(cells, columns=['Date', 'Crop', 'District'])
+        keys = pd.MultiIndex.from_frame(frame[['Crop', 'District']])
+        base_prices = self.recent_series.reindex(keys).to_numpy()
+        fallback = frame['Crop'].map(self.crop_means).to_numpy(dtype=float)
+        base_prices = np.where(np.isnan(base_prices), fallback, base_prices)
+        
+        variation = np.random.uniform(-self.variation, self.variation, len(frame))
+        prices = np.round(base_prices * (1.0 + variation), 2)
+        return [None if np.isnan(price) else float(price) for price in prices]
+
+
+class FileFeedAdapter(IngestAdapter):
+    """
+    Reads prices from a local CSV feed with Date, Crop, District and Price columns
+    """
+
+    name = 'file'
+    supports_batch = True
+
+    def __init__(self, path=INGEST_FEED_PATH):
+        feed = pd.read_csv(path)
+        feed['Date'] = pd.to_datetime(feed['Date']).dt.strftime('%Y-%m-%d')
+        self.prices = {
+            (date_str, crop, district): float(price)
+            for date_str, crop, district, price
+            in feed[['Date', 'Crop', 'District', 'Price']].itertuples(index=False)
+        }
+
+    def fetch(self, date_str, crop, district):
+        return self.prices.get((date_str, crop, district))
+
+    def fetch_batch(self, cells):
+        return [self.prices.get(cell) for cell in cells]
+
+
+class HttpFeedAdapter(IngestAdapter):
+    """
+    Fetches prices from an HTTP feed:
+        GET {base_url}/price?date=YYYY-MM-DD&crop=...&district=...  ->  {"price": 1234.5}
+    A 404 response means no price was reported. Each worker thread keeps one keep-alive
+    connection open, so the pool holds at most as many connections as there are workers.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url=INGEST_FEED_URL, timeout=10):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'http'
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def _connection(self):
+        """
+        Get this thread's pooled connection (created on first use)
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.timeout)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _reset_connection(self):
+        """
+        Drop this thread's connection after an error; the next fetch reconnects
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+            with self._connections_lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+
+    def fetch(self, date_str, crop, district):
+        query = urlencode({'date': date_str, 'crop': crop, 'district': district})
+        try:
+            connection = self._connection()
+            connection.request('GET', f"{self.base_path}/price?{query}")
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._reset_connection()
+            raise FetchError(f"{crop}/{district}/{date_str}: {str(e)}")
+
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise FetchError(f"{crop}/{district}/{date_str}: HTTP {response.status}")
+        price = json.loads(body).get('price')
+        return None if price is None else float(price)
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+def get_adapter(df, name=INGEST_ADAPTER):
+    """
+    Create the configured ingest adapter
+    df: Current dataset (used by the simulated adapter)
+    """
+    if name == 'simulated':
+        return SimulatedAdapter(df)
+    if name == 'file':
+        return FileFeedAdapter()
+    if name == 'http':
+        return HttpFeedAdapter()
+    raise ValueError(f"Unknown ingest adapter: {name}")
+
+
+class BulkFetcher:
+    """
+    Fetches many (date, crop, district) cells through an adapter
+    - bounded concurrency: at most max_workers fetches in flight
+    - retries with exponential backoff and jitter on FetchError
+    - resumable: finished cells are appended to a JSON-lines checkpoint, and cells already
+      in the checkpoint are not fetched again
+    """
+
+    def __init__(self, adapter, max_workers=INGEST_MAX_WORKERS, retries=3, backoff=0.5,
+                 checkpoint_path=None):
+        self.adapter = adapter
+        self.max_workers = max(1, max_workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.checkpoint_path = checkpoint_path
+        self._checkpoint_lock = threading.Lock()
+
+    def load_checkpoint(self):
+        """
+        Load cells finished by an earlier, interrupted run
+        Returns dict mapping (date, crop, district) to price (None = not reported)
+        """
+        done = {}
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line
+                done[(record['date'], record['crop'], record['district'])] = record['price']
+        return done
+
+    def _record(self, checkpoint_file, cell, price):
+        """
+        Append one finished cell to the checkpoint
+        """
+        if checkpoint_file is None:
+            return
+        date_str, crop, district = cell
+        line = json.dumps({'date': date_str, 'crop': crop, 'district': district, 'price': price})
+        with self._checkpoint_lock:
+            checkpoint_file.write(line + '\n')
+            checkpoint_file.flush()
+
+    def _fetch_with_retry(self, cell):
+        """
+        Fetch one cell, retrying on FetchError with exponential backoff
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.adapter.fetch(*cell)
+            except FetchError:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+
+    def fetch_all(self, cells):
+        """
+        Fetch all cells
+        Returns (results, failures): results maps each fetched cell to its price (None if not
+        reported), failures maps cells that still failed after all retries to the error
+        """
+        results = self.load_checkpoint()
+        pending = [cell for cell in cells if cell not in results]
+        if len(results) > 0:
+            print(f"Resuming ingest: {len(results)} cells from checkpoint, {len(pending)} to fetch")
+
+        failures = {}
+        checkpoint_file = None
+        if self.checkpoint_path:
+            os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+            checkpoint_file = open(self.checkpoint_path, 'a')
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Submit in windows so that huge cell lists don't create all futures at once
+                window = self.max_workers * 4
+                for start in range(0, len(pending), window):
+                    futures = {executor.submit(self._fetch_with_retry, cell): cell
+                               for cell in pending[start:start + window]}
+                    for future in as_completed(futures):
+                        cell = futures[future]
+                        try:
+                            price = future.result()
+                        except Exception as e:
+                            failures[cell] = str(e)
+                            continue
+                        results[cell] = price
+                        self._record(checkpoint_file, cell, price)
+        finally:
+            if checkpoint_file is not None:
+                checkpoint_file.close()
+
+        return results, failures
+
+    def clear_checkpoint(self):
+        """
+        Remove the checkpoint after a successful run
+        """
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+def get_checkpoint_path(label):
+    """
+    Checkpoint file for an ingest run (e.g. one per update date)
+    """
+    return os.path.join('data', 'ingest_checkpoints', f"{label}.jsonl")
+
+
+def serve_feed(adapter, port=8765, latency_ms=0):
+    """
+    Run a stand-in HTTP price feed backed by an adapter (for offline testing of HttpFeedAdapter)
+    latency_ms: Artificial delay per request, to mimic a remote mandi feed
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+            params = {key: values[0] for key, values in parse_qs(query).items()}
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+
+            price = None
+            if path.rstrip('/').endswith('/price'):
+                price = adapter.fetch(params.get('date'), params.get('crop'), params.get('district'))
+            status, payload = (200, {'price': price}) if price is not None else (404, {'error': 'not found'})
+
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class FeedServer(ThreadingHTTPServer):
+        # The default listen backlog of 5 drops connections once more clients connect at
+        # once, which would make the feed the bottleneck of the benchmark
+        request_queue_size = 128
+        daemon_threads = True
+
+    return FeedServer(('127.0.0.1', port), FeedHandler)
+
+
+def run_benchmark(markets=100, latency_ms=50, concurrency_levels=(1, 8, 32)):
+    """
+    Measure ingest time against the stand-in HTTP feed for different concurrency levels
+    """
+    from data.data_handler import load_data
+
+    df = load_data()
+    server = serve_feed(SimulatedAdapter(df), port=0, latency_ms=latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    crops = sorted(df['Crop'].unique())
+    districts = sorted(df['District'].unique())
+    # Emulate several markets per district with distinct market names, so that every
+    # cell is a different (crop, market) pair (the feed answers them with crop averages)
+    market_names = [f"{districts[i % len(districts)]} market {i // len(districts) + 1}" for i in range(markets)]
+    cells = [(today, crop, market) for market in market_names for crop in crops]
+
+    print(f"Fetching {len(cells)} cells ({markets} markets x {len(crops)} crops) "
+          f"with {latency_ms}ms feed latency")
+    for workers in concurrency_levels:
+        adapter = HttpFeedAdapter(url)
+        started = time.perf_counter()
+        results, failures = BulkFetcher(adapter, max_workers=workers).fetch_all(cells)
+        adapter.close()
+        elapsed = time.perf_counter() - started
+        print(f"  {workers:3d} workers: {elapsed:6.2f}s ({len(cells) / elapsed:7.1f} cells/s, "
+              f"{len(failures)} failures)")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    import argparse
+    from data.data_handler import load_data
+
+    parser = argparse.ArgumentParser(description='Price feed ingest tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='Run a stand-in HTTP price feed')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--latency-ms', type=float, default=0)
+    serve_parser.add_argument('--feed', help='CSV feed to serve (default: simulated prices)')
+    bench_parser = subparsers.add_parser('bench', help='Measure ingest time vs concurrency')
+    bench_parser.add_argument('--markets', type=int, default=100)
+    bench_parser.add_argument('--latency-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        feed_adapter = FileFeedAdapter(args.feed) if args.feed else SimulatedAdapter(load_data())
+        feed_server = serve_feed(feed_adapter, port=args.port, latency_ms=args.latency_ms)
+        print(f"Serving {feed_adapter.name} price feed on http://127.0.0.1:{args.port}/price")
+        feed_server.serve_forever()
+    else:
+        run_benchmark(markets=args.markets, latency_ms=args.latency_ms)
@@ -0,0 +1,455 @@
+"""
+Data Quality and Model Drift Monitor
+Runs after each ingest and only looks at the rows added since its last run
+
+- Keeps running statistics (count, mean, variance, min, max, last price) per crop and district
+  with Welford's algorithm, so memory stays constant however long the history grows
+- Flags new rows that are invalid, far outside the usual range of their crop and district,
+  jump sharply from the previous price, or are missing for a district
+- Measures the error of the current model on the new rows before it is retrained, and the
+  error of the forecasts actually served to users (logged by record_forecasts) once their
+  dates are reached
+- Reports drift when the recent error exceeds DRIFT_MAPE_THRESHOLD, which the scheduler
+  can use to retrain only when needed (RETRAIN_POLICY=drift)
+
+Usage:
+    python -m data.monitor    # process new rows and print the report
+"""
+
+import os
+import json
+import math
+import sqlite3
+import threading
+from datetime import datetime
+import snapshots
+from lazy_import import lazy_import
+from data.data_handler import load_data
+
+# pandas is imported on first use to keep application startup fast
+pd = lazy_import('pandas')
+
+
+# Running statistics, last processed date and recent findings
+MONITOR_STATE_PATH = os.path.join('data', 'monitor_state.json')
+
+# Forecasts served to users, aggregated per target date, crop and district
+FORECAST_LOG_PATH = os.path.join('data', 'forecast_log.sqlite3')
+
+# Set FORECAST_LOG_ENABLED=false to stop logging served forecasts
+FORECAST_LOG_ENABLED = os.environ.get('FORECAST_LOG_ENABLED', 'true').lower() == 'true'
+
+# Served forecasts still without a recorded price this many days after their target date
+# are dropped (the market may not have reported that day)
+FORECAST_RETENTION_DAYS = int(os.environ.get('FORECAST_RETENTION_DAYS', '90'))
+
+# A price more than this many standard deviations from its crop/district mean is an outlier
+OUTLIER_Z = float(os.environ.get('MONITOR_OUTLIER_Z', '4'))
+
+# Observations needed before outliers are flagged for a crop and district
+MIN_OBSERVATIONS = 10
+
+# Relative change from the previous price of a crop/district that counts as a jump
+JUMP_THRESHOLD = float(os.environ.get('MONITOR_JUMP_THRESHOLD', '0.3'))
+
+# Recent mean absolute percentage error (%) above which the model is considered drifted
+DRIFT_MAPE_THRESHOLD = float(os.environ.get('DRIFT_MAPE_THRESHOLD', '15'))
+
+# Realized predictions needed (since the last model change) before drift is reported
+DRIFT_MIN_SAMPLES = int(os.environ.get('DRIFT_MIN_SAMPLES', '20'))
+
+# Weight of a new error in the recent (exponentially weighted) error
+RECENT_ERROR_ALPHA = 0.05
+
+# Number of findings kept in the state
+MAX_ISSUES = 200
+
+_state_lock = threading.Lock()
+_log_local = threading.local()
+
+
+def _new_running():
+    """
+    Empty running statistics
+    """
+    return {'n': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+
+
+def _update_running(stats, value):
+    """
+    Add one value to running statistics (Welford's algorithm)
+    """
+    stats['n'] += 1
+    delta = value - stats['mean']
+    stats['mean'] += delta / stats['n']
+    stats['m2'] += delta * (value - stats['mean'])
+    stats['min'] = value if stats['min'] is None else min(stats['min'], value)
+    stats['max'] = value if stats['max'] is None else max(stats['max'], value)
+
+
+def _std(stats):
+    """
+    Sample standard deviation of running statistics
+    """
+    return math.sqrt(stats['m2'] / (stats['n'] - 1)) if stats['n'] > 1 else 0.0
+
+
+def _new_error_tracker():
+    """
+    Running statistics of absolute percentage errors plus an exponentially weighted recent error
+    """
+    return {'all': _new_running(), 'recent_mape': None, 'samples': 0}
+
+
+def _update_error_tracker(tracker, ape):
+    """
+    Add one absolute percentage error (%)
+    """
+    _update_running(tracker['all'], ape)
+    tracker['samples'] += 1
+    if tracker['recent_mape'] is None:
+        tracker['recent_mape'] = ape
+    else:
+        tracker['recent_mape'] += RECENT_ERROR_ALPHA * (ape - tracker['recent_mape'])
+
+
+def load_state():
+    """
+    Load the monitor state
+    Returns dict (fresh state if the monitor has not run yet)
+    """
+    try:
+        with open(MONITOR_STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {
+            'watermark': None,
+            'model_version': None,
+            'pairs': {},
+            'model_error': _new_error_tracker(),
+            'served_error': _new_error_tracker(),
+            'issues': [],
+            'last_run': None
+        }
+
+
+def save_state(state):
+    """
+    Persist the monitor state atomically
+    """
+    temp_path = f"{MONITOR_STATE_PATH}.tmp.{os.getpid()}"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, MONITOR_STATE_PATH)
+
+
+def _log_connection():
+    """
+    Connection to the served forecast log (one per thread)
+    """
+    connection = getattr(_log_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(FORECAST_LOG_PATH, timeout=0.5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+        connection.execute('CREATE TABLE IF NOT EXISTS served_forecasts ('
+                           'target_date TEXT, crop TEXT, district TEXT, '
+                           'predicted_sum REAL NOT NULL, served INTEGER NOT NULL, '
+                           'PRIMARY KEY (target_date, crop, district))')
+        _log_local.connection = connection
+    return connection
+
+
+def record_forecasts(records):
+    """
+    Log forecasts served to users so they can be compared with the realized prices later
+    records: Iterable of (crop, district, target_date, predicted_price)
+    Repeated forecasts for the same target are aggregated, so the log stays small
+    """
+    if not FORECAST_LOG_ENABLED:
+        return
+    rows = [(target_date.strftime('%Y-%m-%d'), crop, district, float(price))
+            for crop, district, target_date, price in records if price is not None]
+    if not rows:
+        return
+    connection = None
+    try:
+        connection = _log_connection()
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO served_forecasts (target_date, crop, district, predicted_sum, served) '
+            'VALUES (?, ?, ?, ?, 1) ON CONFLICT (target_date, crop, district) DO UPDATE SET '
+            'predicted_sum = predicted_sum + excluded.predicted_sum, served = served + 1',
+            rows)
+        connection.execute('COMMIT')
+    except sqlite3.Error as e:
+        # Monitoring must never break serving
+        if connection is not None and connection.in_transaction:
+            connection.execute('ROLLBACK')
+        print(f"Could not log served forecasts: {str(e)}")
+
+
+def _load_served_forecasts(up_to_date):
+    """
+    Read served forecasts whose target date has been reached
+    They stay in the log until _remove_served_forecasts() is called after the state is saved
+    Returns list of (date_str, crop, district, mean predicted price, times served)
+    """
+    if not os.path.exists(FORECAST_LOG_PATH):
+        return []
+    connection = _log_connection()
+    return connection.execute('SELECT target_date, crop, district, predicted_sum / served, served '
+                              'FROM served_forecasts WHERE target_date <= ?', (up_to_date,)).fetchall()
+
+
+def _remove_served_forecasts(scored, expire_before):
+    """
+    Remove served forecasts that were compared with their realized price, and those whose
+    price has not been recorded by expire_before
+    scored: List of (date_str, crop, district, times served) as read; a forecast served
+    again since then is kept
+    """
+    if not os.path.exists(FORECAST_LOG_PATH):
+        return
+    connection = _log_connection()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.executemany('DELETE FROM served_forecasts WHERE target_date = ? AND crop = ? '
+                               'AND district = ? AND served = ?', scored)
+        connection.execute('DELETE FROM served_forecasts WHERE target_date < ?', (expire_before,))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+
+
+def _add_issue(issues, kind, date_str, crop, district, message):
+    """
+    Record one finding
+    """
+    issues.append({'type': kind, 'date': date_str, 'crop': crop, 'district': district, 'message': message})
+
+
+def _check_rows(state, new_rows, issues):
+    """
+    Check new rows against the running statistics, then add them to the statistics
+    Rows must be sorted by date
+    """
+    pairs = state['pairs']
+    seeding = state['watermark'] is None
+    for date_value, crop, district, price in zip(new_rows['Date'], new_rows['Crop'],
+                                                 new_rows['District'], new_rows['Price']):
+        date_str = date_value.strftime('%Y-%m-%d')
+        key = f"{crop}|{district}"
+        stats = pairs.get(key)
+        if stats is None:
+            stats = pairs[key] = dict(_new_running(), last_price=None, last_date=None)
+
+        if price is None or not math.isfinite(price) or price <= 0:
+            if not seeding:
+                _add_issue(issues, 'invalid_price', date_str, crop, district, f"Invalid price {price}")
+            continue
+
+        # The first run only builds the statistics; there is nothing to compare against yet
+        if not seeding:
+            std = _std(stats)
+            if stats['n'] >= MIN_OBSERVATIONS and std > 0 and abs(price - stats['mean']) > OUTLIER_Z * std:
+                _add_issue(issues, 'outlier', date_str, crop, district,
+                           f"Price {price:.2f} is {abs(price - stats['mean']) / std:.1f} standard deviations "
+                           f"from the mean {stats['mean']:.2f}")
+            if stats['last_price'] and abs(price / stats['last_price'] - 1) > JUMP_THRESHOLD:
+                _add_issue(issues, 'price_jump', date_str, crop, district,
+                           f"Price changed {(price / stats['last_price'] - 1) * 100:+.1f}% from "
+                           f"{stats['last_price']:.2f} on {stats['last_date']}")
+
+        _update_running(stats, float(price))
+        stats['last_price'] = float(price)
+        stats['last_date'] = date_str
+
+
+def _check_missing(state, new_rows, issues):
+    """
+    Flag districts without a price on a date for which their crop has prices elsewhere
+    """
+    known = {}
+    for key in state['pairs']:
+        crop, district = key.split('|', 1)
+        known.setdefault(crop, set()).add(district)
+
+    for (date_value, crop), group in new_rows.groupby(['Date', 'Crop']):
+        missing = sorted(known.get(crop, set()) - set(group['District']))
+        if missing:
+            date_str = date_value.strftime('%Y-%m-%d')
+            _add_issue(issues, 'missing_districts', date_str, crop, None,
+                       f"No price for {len(missing)} districts: {', '.join(missing[:10])}"
+                       f"{' ...' if len(missing) > 10 else ''}")
+
+
+def _check_model_error(state, new_rows):
+    """
+    Error of the current model on the new rows (run before the model is retrained on them)
+    """
+    # Imported here because model.predict is not needed for the data quality checks
+    from model.predict import load_model, predict_prices
+
+    model_version = snapshots.version_key('model', 'trained_model.pkl')
+    if state['model_version'] != model_version:
+        # A new model starts with a clean error history
+        state['model_version'] = model_version
+        state['model_error'] = _new_error_tracker()
+        state['served_error'] = _new_error_tracker()
+
+    model, feature_names = load_model()
+    if model is None:
+        return
+    valid = new_rows[new_rows['Price'] > 0]
+    items = list(zip(valid['Crop'], valid['District'], valid['Date'].dt.date))
+    predicted = predict_prices(items, model, feature_names)
+    if predicted is None:
+        return
+    for actual, prediction in zip(valid['Price'], predicted):
+        _update_error_tracker(state['model_error'], abs(prediction - actual) / actual * 100)
+
+
+def _check_served_forecasts(state, df, up_to_date):
+    """
+    Compare forecasts served to users with the realized prices
+    Forecasts are looked up in the whole dataset, so prices that arrive late (e.g. through a
+    backfill) still count
+    Returns list of (date_str, crop, district, times served) of the scored forecasts
+    """
+    served = _load_served_forecasts(up_to_date)
+    if not served:
+        return []
+    forecasts = pd.DataFrame(served, columns=['TargetDate', 'Crop', 'District', 'Predicted', 'Served'])
+    forecasts['Date'] = pd.to_datetime(forecasts['TargetDate'])
+    actual = df[['Date', 'Crop', 'District', 'Price']].drop_duplicates(['Date', 'Crop', 'District'])
+    matched = forecasts.merge(actual, on=['Date', 'Crop', 'District'], how='inner')
+
+    scored = []
+    for date_str, crop, district, predicted, count, price in zip(
+            matched['TargetDate'], matched['Crop'], matched['District'], matched['Predicted'],
+            matched['Served'], matched['Price']):
+        if price > 0:
+            _update_error_tracker(state['served_error'], abs(predicted - price) / price * 100)
+            scored.append((date_str, crop, district, int(count)))
+    return scored
+
+
+def drift_status(state):
+    """
+    Decide whether the model has drifted, from the recent error on new data
+    Returns dict with drift_detected, recent_mape, samples and threshold
+    """
+    tracker = state['model_error']
+    recent = tracker['recent_mape']
+    detected = (tracker['samples'] >= DRIFT_MIN_SAMPLES and recent is not None
+                and recent > DRIFT_MAPE_THRESHOLD)
+    return {
+        'drift_detected': detected,
+        'recent_mape': round(recent, 2) if recent is not None else None,
+        'samples': tracker['samples'],
+        'threshold': DRIFT_MAPE_THRESHOLD
+    }
+
+
+def run_monitor(df=None):
+    """
+    Process the rows added since the last run
+    Must run after an ingest and before the model is retrained on the new rows
+    Returns the report (see get_report)
+    """
+    with _state_lock, snapshots.pinned():
+        state = load_state()
+        if df is None:
+            df = load_data()
+        if df is None or len(df) == 0:
+            return get_report(state)
+
+        new_rows = df
+        if state['watermark'] is not None:
+            new_rows = df[df['Date'] > pd.Timestamp(state['watermark'])]
+        new_rows = new_rows.sort_values('Date', kind='stable')
+
+        issues = []
+        scored = []
+        if len(new_rows) > 0:
+            seeding = state['watermark'] is None
+            _check_rows(state, new_rows, issues)
+            if not seeding:
+                _check_missing(state, new_rows, issues)
+                _check_model_error(state, new_rows)
+            state['watermark'] = new_rows['Date'].max().strftime('%Y-%m-%d')
+        if state['watermark'] is not None:
+            scored = _check_served_forecasts(state, df, state['watermark'])
+
+        state['issues'] = (issues + state['issues'])[:MAX_ISSUES]
+        state['last_run'] = {
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'new_rows': int(len(new_rows)),
+            'new_issues': len(issues),
+            'served_forecasts_matched': len(scored)
+        }
+        save_state(state)
+
+        # Only now that their errors are saved, scored forecasts leave the log
+        if state['watermark'] is not None:
+            expire_before = (pd.Timestamp(state['watermark'])
+                             - pd.Timedelta(days=FORECAST_RETENTION_DAYS)).strftime('%Y-%m-%d')
+            _remove_served_forecasts(scored, expire_before)
+
+    report = get_report(state)
+    print(f"Monitor: {len(new_rows)} new rows, {len(issues)} issues, "
+          f"recent MAPE {report['drift']['recent_mape']}% "
+          f"({'drift detected' if report['drift']['drift_detected'] else 'no drift'})")
+    return report
+
+
+def _running_summary(stats):
+    """
+    Running statistics in a readable form
+    """
+    if stats['n'] == 0:
+        return {'count': 0}
+    return {
+        'count': stats['n'],
+        'mean': round(stats['mean'], 2),
+        'std': round(_std(stats), 2),
+        'min': round(stats['min'], 2),
+        'max': round(stats['max'], 2)
+    }
+
+
+def get_report(state=None, details=False):
+    """
+    Summarize the monitor state
+    details: Include running statistics of every crop and district
+    Returns dict
+    """
+    state = state or load_state()
+    issue_counts = {}
+    for issue in state['issues']:
+        issue_counts[issue['type']] = issue_counts.get(issue['type'], 0) + 1
+
+    report = {
+        'watermark': state['watermark'],
+        'last_run': state['last_run'],
+        'drift': drift_status(state),
+        'model_error': dict(_running_summary(state['model_error']['all']),
+                            recent_mape=state['model_error']['recent_mape']),
+        'served_forecast_error': dict(_running_summary(state['served_error']['all']),
+                                      recent_mape=state['served_error']['recent_mape']),
+        'tracked_pairs': len(state['pairs']),
+        'issue_counts': issue_counts,
+        'recent_issues': state['issues'][:20]
+    }
+    if details:
+        report['pairs'] = {
+            key: dict(_running_summary(stats), last_price=stats['last_price'], last_date=stats['last_date'])
+            for key, stats in state['pairs'].items()
+        }
+    return report
+
+
+if __name__ == '__main__':
+    print(json.dumps(run_monitor(), indent=2))
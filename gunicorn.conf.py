@@ -0,0 +1,66 @@
+"""
+Gunicorn configuration for the Crop Price Prediction app
+Loads the app and warms it up once in the master process; workers are forked from the
+warm master and share the imported libraries and loaded model copy-on-write
+Usage: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+# Bind to the port provided by Render (or 5000 locally)
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Number of worker processes
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+
+# Import the app in the master before forking workers (set PRELOAD_APP=false to disable)
+preload_app = os.environ.get('PRELOAD_APP', 'true').lower() == 'true'
+
+# Start the daily update scheduler in every worker; only the elected leader runs jobs
+enable_scheduler = os.environ.get('ENABLE_SCHEDULER', 'true').lower() == 'true'
+
+# Model training on a cold start can take longer than the default 30s
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+
+def when_ready(server):
+    """
+    Runs in the master after the socket is bound, before workers are forked
+    """
+    # /metrics reports the sum over all workers (see metrics.py)
+    import metrics
+    metrics.enable_multiprocess()
+    
+    if preload_app:
+        from app import warmup
+        warmup()
+
+
+def post_fork(server, worker):
+    """
+    Runs in each worker right after it was forked from the master
+    """
+    import metrics
+    metrics.start_worker()
+
+
+def worker_exit(server, worker):
+    """
+    Runs in a worker that is shutting down; saves its last metrics
+    """
+    import metrics
+    metrics.flush()
+
+
+def post_worker_init(worker):
+    """
+    Runs in each worker after it has loaded the app
+    Without preloading every worker warms up on its own
+    """
+    if not preload_app:
+        from app import warmup
+        warmup()
+    
+    if enable_scheduler:
+        from scheduler import start_scheduler_thread
+        start_scheduler_thread()
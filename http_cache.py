@@ -0,0 +1,290 @@
+"""
+HTTP Caching and Compression
+Response compression (gzip, and brotli when the brotli package is installed), validators
+(ETag / Last-Modified) for conditional requests, and content-hashed static file names
+that can be cached by browsers for a year
+
+Dynamic responses only change when a new data or model snapshot is published, so their
+validators are derived from the snapshot versions and checked before any work is done.
+"""
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from functools import lru_cache
+from email.utils import formatdate
+from flask import request, Response, send_file
+from werkzeug.security import safe_join
+import snapshots
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip is used without it
+    brotli = None
+
+
+# Responses smaller than this (bytes) are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '500'))
+
+# Compression levels for dynamic responses (static files use the maximum once and are cached)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Content types worth compressing (images such as PNG are already compressed)
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+# Cache lifetime of content-hashed static files (one year)
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# Number of hex digits of the content hash inserted into static file names
+STATIC_HASH_LENGTH = 10
+
+# Static files larger than this are streamed from disk instead of held in memory
+STATIC_MEMORY_MAX_BYTES = 1024 * 1024
+
+# Content hash per static file: path -> (mtime_ns, size, hash)
+_static_hashes = {}
+_static_hashes_lock = threading.Lock()
+
+
+def supported_encodings():
+    """
+    Content encodings this server can produce, best first
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding():
+    """
+    Pick the best encoding the client accepts (honouring q-values)
+    Returns 'br', 'gzip' or None
+    """
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def compress_bytes(data, encoding, maximum=False):
+    """
+    Compress data with the given encoding
+    maximum: Use the highest compression level (for static files compressed once)
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if maximum else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if maximum else GZIP_LEVEL, mtime=0)
+
+
+def _add_vary(response):
+    """
+    Tell caches that the response depends on Accept-Encoding
+    """
+    response.vary.add('Accept-Encoding')
+
+
+def compress_response(response):
+    """
+    Compress a response body if the client accepts it and it is worth it
+    Streamed and already encoded responses are left as they are
+    """
+    content_type = response.mimetype or ''
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or not content_type.startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    _add_vary(response)
+    body = response.get_data()
+    encoding = choose_encoding()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    response.set_data(compress_bytes(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _file_key(path):
+    """
+    Identify an unversioned file by modification time and size
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def snapshot_last_modified():
+    """
+    Time the data or model the current request reads was last changed
+    Returns UNIX timestamp, or None if neither exists
+    """
+    times = []
+    for kind, filename in (('data', 'crop_price_data.csv'), ('model', 'trained_model.pkl')):
+        try:
+            times.append(os.path.getmtime(snapshots.snapshot_path(kind, filename)))
+        except OSError:
+            pass
+    return max(times) if times else None
+
+
+def make_etag(*parts):
+    """
+    Build a weak ETag from the values a response depends on
+    Weak, because the same content is served with different encodings
+    """
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Check a conditional request against the response validators, before the response is built
+    Returns a 304 response if the client's copy is still fresh, otherwise None
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag.removeprefix('W/').strip('"'))
+    elif request.if_modified_since is not None and last_modified is not None:
+        fresh = int(last_modified) <= request.if_modified_since.timestamp()
+    else:
+        fresh = False
+    if not fresh:
+        return None
+
+    response = Response(status=304)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None, cache_control=None):
+    """
+    Attach ETag, Last-Modified and Cache-Control headers to a response
+    """
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    if cache_control is not None:
+        response.headers['Cache-Control'] = cache_control
+    _add_vary(response)
+    return response
+
+
+@lru_cache(maxsize=None)
+def build_id(*folders):
+    """
+    Identify the deployed templates and static files (paths, modification times and sizes)
+    Computed once per process; a deploy restarts the process
+    """
+    digest = hashlib.sha1()
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(f"{path}|{_file_key(path)}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+def static_file_hash(static_folder, filename):
+    """
+    Content hash of a static file, recomputed only when the file changes
+    Returns None if the file does not exist
+    """
+    path = os.path.join(static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    with _static_hashes_lock:
+        cached = _static_hashes.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    with open(path, 'rb') as f:
+        file_hash = hashlib.md5(f.read()).hexdigest()[:STATIC_HASH_LENGTH]
+    with _static_hashes_lock:
+        _static_hashes[path] = (stat.st_mtime_ns, stat.st_size, file_hash)
+    return file_hash
+
+
+def hashed_static_name(static_folder, filename):
+    """
+    Insert the content hash into a static file name: css/style.css -> css/style.1a2b3c4d5e.css
+    Returns the name unchanged if the file does not exist
+    """
+    file_hash = static_file_hash(static_folder, filename)
+    if file_hash is None:
+        return filename
+    base, extension = os.path.splitext(filename)
+    return f"{base}.{file_hash}{extension}"
+
+
+def split_hashed_name(static_folder, filename):
+    """
+    Undo hashed_static_name
+    Returns (filename, hash), where hash is None if the name carries no hash of an existing file
+    """
+    base, extension = os.path.splitext(filename)
+    original_base, _, file_hash = base.rpartition('.')
+    if (original_base and len(file_hash) == STATIC_HASH_LENGTH
+            and all(c in '0123456789abcdef' for c in file_hash)
+            and not os.path.exists(os.path.join(static_folder, filename))):
+        return original_base + extension, file_hash
+    return filename, None
+
+
+@lru_cache(maxsize=64)
+def _load_static(path, file_hash, encoding):
+    """
+    Static file contents, compressed with the maximum level when an encoding is given
+    Cached per content hash, so every file is compressed only once
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return compress_bytes(data, encoding, maximum=True) if encoding else data
+
+
+def serve_static(static_folder, filename):
+    """
+    Serve a static file
+    Content-hashed names (see hashed_static_name) are cached for a year as immutable;
+    plain names must be revalidated with their ETag
+    """
+    filename, requested_hash = split_hashed_name(static_folder, filename)
+    path = safe_join(static_folder, filename)
+    file_hash = static_file_hash(static_folder, filename) if path is not None else None
+    if file_hash is None or not os.path.isfile(path):
+        return Response('Not Found', status=404, mimetype='text/plain')
+
+    if requested_hash == file_hash:
+        cache_control = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    else:
+        # Unhashed or outdated name: the content may change under this URL
+        cache_control = 'public, no-cache'
+
+    etag = f'"{file_hash}"'
+    last_modified = os.path.getmtime(path)
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        cached.headers['Cache-Control'] = cache_control
+        return cached
+
+    if os.path.getsize(path) > STATIC_MEMORY_MAX_BYTES:
+        response = send_file(os.path.abspath(path), conditional=False, etag=False)
+        return set_validators(response, etag, last_modified, cache_control)
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/javascript':
+        content_type += '; charset=utf-8'
+    response = Response(content_type=content_type)
+
+    encoding = None
+    if content_type.startswith(COMPRESSIBLE_TYPES) and os.path.getsize(path) >= COMPRESS_MIN_BYTES:
+        encoding = choose_encoding()
+    response.set_data(_load_static(path, file_hash, encoding))
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return set_validators(response, etag, last_modified, cache_control)
@@ -0,0 +1,63 @@
+"""
+Lazy Import Helper
+Defers importing heavy libraries (pandas, matplotlib, scikit-learn) until first use
+so that importing the Flask app stays fast
+"""
+
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access
+    Usage: pd = lazy_import('pandas'), then use pd.DataFrame as usual
+    """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        Import the real module (once, thread-safe) and return it
+        """
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import is not None:
+                        self._on_import(module)
+                    self._module = module
+                module = self._module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name, on_import=None):
+    """
+    Return a LazyModule for the given module name
+    on_import: Optional callback run with the real module right after it is imported
+    """
+    return LazyModule(name, on_import)
+
+
+def preload(*modules):
+    """
+    Import lazily imported modules now (e.g. during warmup)
+    """
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module._load()
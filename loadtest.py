@@ -0,0 +1,444 @@
+"""
+Load Test for the Crop Price Prediction app
+Replays a realistic traffic mix against a running server (or a gunicorn instance it starts)
+and reports throughput, latency percentiles, error rates and worker memory over time
+
+Crop/district pairs are drawn from a Zipf distribution, so a few popular markets get most
+of the traffic as in real use. With several --concurrency values the test runs one stage
+per value, which shows where throughput stops growing (the saturation point).
+
+Usage:
+    python loadtest.py --start-server --workers 2 --duration 30 --concurrency 4 8 16 32
+    python loadtest.py --url http://localhost:5000 --mix api_predict=80,index=20
+    python loadtest.py --start-server --update-at 10    # fire POST /update 10s into each stage
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import date, timedelta
+from urllib.parse import urlencode, urlsplit
+
+from app import VALID_CROPS, KARNATAKA_DISTRICTS
+
+
+# Default share of each request type
+DEFAULT_MIX = 'index=10,predict=20,api_predict=50,api_predict_get=15,compare=5'
+
+# Request types that can be used in --mix
+REQUEST_TYPES = ('index', 'predict', 'api_predict', 'api_predict_get', 'compare')
+
+# Seconds to wait for a started server to become ready
+SERVER_START_TIMEOUT = 180
+
+
+class TrafficModel:
+    """
+    Generates requests: Zipf-skewed crop/district pairs and forecast dates within a year
+    """
+
+    def __init__(self, mix, zipf_s=1.1, seed=42):
+        self.random = random.Random(seed)
+        self.types = list(mix)
+        self.type_weights = [mix[name] for name in self.types]
+
+        # Popularity rank of every market, fixed by the seed
+        self.pairs = [(crop, district) for crop in VALID_CROPS for district in KARNATAKA_DISTRICTS]
+        self.random.shuffle(self.pairs)
+        self.pair_weights = [1 / (rank ** zipf_s) for rank in range(1, len(self.pairs) + 1)]
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        """
+        Returns (request type, method, path, body, headers)
+        """
+        with self._lock:
+            kind = self.random.choices(self.types, self.type_weights)[0]
+            crop, district = self.random.choices(self.pairs, self.pair_weights)[0]
+            # Near-term dates are asked for more often
+            target = date.today() + timedelta(days=min(364, int(self.random.expovariate(1 / 60))))
+        fields = {'crop': crop, 'district': district, 'date': target.strftime('%Y-%m-%d')}
+
+        if kind == 'index':
+            return kind, 'GET', '/', None, {}
+        if kind == 'predict':
+            return (kind, 'POST', '/predict', urlencode(fields).encode(),
+                    {'Content-Type': 'application/x-www-form-urlencoded'})
+        if kind == 'api_predict':
+            return kind, 'POST', '/api/predict', json.dumps(fields).encode(), {'Content-Type': 'application/json'}
+        if kind == 'api_predict_get':
+            return kind, 'GET', f"/api/predict?{urlencode(fields)}", None, {}
+        return kind, 'GET', f"/api/compare?{urlencode({'crop': crop})}", None, {}
+
+
+class Results:
+    """
+    Thread-safe collection of request outcomes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}     # request type -> list of seconds
+        self.statuses = {}      # request type -> {status: count}
+        self.window = []        # latencies since the last timeline sample
+
+    def record(self, kind, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            counts = self.statuses.setdefault(kind, {})
+            counts[status] = counts.get(status, 0) + 1
+            self.window.append(seconds)
+
+    def take_window(self):
+        with self._lock:
+            window, self.window = self.window, []
+            return window
+
+
+def percentile(values, fraction):
+    """
+    Percentile of an already sorted list (nearest rank)
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def is_error(status):
+    """
+    Connection errors and 5xx responses count as errors; 429 is reported separately
+    """
+    return status == 'error' or (isinstance(status, int) and status >= 500)
+
+
+def client_loop(host, port, traffic, results, stop_event):
+    """
+    One simulated client: sends requests back to back over a keep-alive connection
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    while not stop_event.is_set():
+        kind, method, path, body, headers = traffic.next_request()
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            status = 'error'
+            connection.close()
+        results.record(kind, status, time.perf_counter() - started)
+    connection.close()
+
+
+def fire_update(host, port, admin_token, events):
+    """
+    Send POST /update (data update and retrain) and record how long it took
+    """
+    started = time.perf_counter()
+    headers = {'X-Admin-Token': admin_token} if admin_token else {}
+    try:
+        connection = http.client.HTTPConnection(host, port, timeout=600)
+        connection.request('POST', '/update', headers=headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+        connection.close()
+    except (OSError, http.client.HTTPException) as e:
+        status = f"error: {e}"
+    events.append({'event': 'update', 'status': status, 'seconds': round(time.perf_counter() - started, 2)})
+
+
+def find_workers(master_pid):
+    """
+    PIDs of the child processes (gunicorn workers) of a process, read from /proc
+    """
+    workers = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name may contain spaces; fields after it are space separated
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == master_pid:
+                workers.append(int(name))
+        except (OSError, IndexError, ValueError):
+            continue
+    return sorted(workers)
+
+
+def process_memory(pid):
+    """
+    Resident (RSS) and proportional (PSS, shared pages split between processes) memory in MB
+    Returns (rss_mb, pss_mb); values are None where /proc does not provide them
+    """
+    rss = pss = None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss, pss
+
+
+def sample_memory(master_pid):
+    """
+    Memory of the server's master and worker processes
+    Returns dict pid -> (rss_mb, pss_mb)
+    """
+    if master_pid is None or not os.path.exists('/proc'):
+        return {}
+    pids = [master_pid] + find_workers(master_pid)
+    return {pid: process_memory(pid) for pid in pids}
+
+
+def _get_status(port, path):
+    """
+    Status code of a GET request to the local server, or None if it does not answer
+    """
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        try:
+            connection.request('GET', path)
+            return connection.getresponse().status
+        finally:
+            connection.close()
+    except (OSError, http.client.HTTPException):
+        return None
+
+
+def start_server(port, workers, extra_env):
+    """
+    Start gunicorn with the repository's configuration and wait until it answers
+    Liveness (/healthz) and readiness (/ready, model loaded; see warmup() in app.py) are
+    timed separately. If the server is live but does not become ready in time, the test
+    runs anyway and the first requests pay for loading the model
+    Rate limiting and the scheduler are turned off, so they don't skew the measurement
+    Returns (gunicorn master process, dict with seconds to live and to ready)
+    """
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               RATE_LIMIT_ENABLED='false', ENABLE_SCHEDULER='false', **extra_env)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    startup = {'seconds_to_live': None, 'seconds_to_ready': None}
+    deadline = time.time() + SERVER_START_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {process.returncode}")
+        if startup['seconds_to_live'] is None and _get_status(port, '/healthz') == 200:
+            startup['seconds_to_live'] = round(time.perf_counter() - started, 2)
+        if startup['seconds_to_live'] is not None and _get_status(port, '/ready') == 200:
+            startup['seconds_to_ready'] = round(time.perf_counter() - started, 2)
+            return process, startup
+        time.sleep(0.5)
+
+    if startup['seconds_to_live'] is None:
+        process.terminate()
+        raise SystemExit(f"gunicorn did not answer /healthz within {SERVER_START_TIMEOUT}s")
+    print(f"Warning: server is live but not ready after {SERVER_START_TIMEOUT}s, testing anyway")
+    return process, startup
+
+
+def format_memory(memory):
+    """
+    Format a memory sample as 'pid:rss/pss' entries
+    """
+    return ' '.join(f"{pid}:{rss:.0f}/{pss:.0f}MB" if rss is not None and pss is not None
+                    else f"{pid}:{rss or 0:.0f}MB"
+                    for pid, (rss, pss) in memory.items())
+
+
+def run_stage(host, port, traffic, concurrency, duration, interval, update_at, admin_token, master_pid):
+    """
+    Run one load stage with a fixed number of concurrent clients
+    Returns dict with the stage summary, per-request-type results and timeline
+    """
+    results = Results()
+    stop_event = threading.Event()
+    events = []
+    timeline = []
+
+    clients = [threading.Thread(target=client_loop, args=(host, port, traffic, results, stop_event), daemon=True)
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+
+    pending_updates = sorted(update_at or [])
+    update_threads = []
+    next_sample = interval
+    print(f"\nStage: {concurrency} clients for {duration}s")
+    print(f"{'t(s)':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}  memory (pid:RSS/PSS)")
+
+    while True:
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            break
+        while pending_updates and elapsed >= pending_updates[0]:
+            pending_updates.pop(0)
+            print(f"{elapsed:6.1f} firing POST /update")
+            thread = threading.Thread(target=fire_update, args=(host, port, admin_token, events), daemon=True)
+            thread.start()
+            update_threads.append(thread)
+        if elapsed >= next_sample:
+            window = sorted(results.take_window())
+            memory = sample_memory(master_pid)
+            sample = {
+                't': round(elapsed, 1),
+                'requests_per_second': round(len(window) / interval, 1),
+                'p50_ms': round(percentile(window, 0.5) * 1000, 1) if window else None,
+                'p95_ms': round(percentile(window, 0.95) * 1000, 1) if window else None,
+                'memory_mb': {str(pid): {'rss': rss, 'pss': pss} for pid, (rss, pss) in memory.items()}
+            }
+            timeline.append(sample)
+            print(f"{sample['t']:6.1f} {sample['requests_per_second']:8.1f} {sample['p50_ms'] or 0:8.1f} "
+                  f"{sample['p95_ms'] or 0:8.1f}  {format_memory(memory)}")
+            next_sample += interval
+        time.sleep(0.05)
+
+    stop_event.set()
+    for client in clients:
+        client.join(timeout=60)
+    wall_seconds = time.perf_counter() - started
+    for thread in update_threads:
+        thread.join(timeout=600)
+
+    by_type = {}
+    total = errors = limited = 0
+    all_latencies = []
+    for kind, latencies in sorted(results.latencies.items()):
+        latencies.sort()
+        statuses = results.statuses[kind]
+        count = len(latencies)
+        kind_errors = sum(n for status, n in statuses.items() if is_error(status))
+        kind_limited = statuses.get(429, 0)
+        by_type[kind] = {
+            'requests': count,
+            'requests_per_second': round(count / wall_seconds, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p90_ms': round(percentile(latencies, 0.90) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'max_ms': round(latencies[-1] * 1000, 1),
+            'error_rate': round(kind_errors / count, 4),
+            'rate_limited': kind_limited,
+            'statuses': {str(status): n for status, n in statuses.items()}
+        }
+        total += count
+        errors += kind_errors
+        limited += kind_limited
+        all_latencies.extend(latencies)
+    all_latencies.sort()
+
+    summary = {
+        'concurrency': concurrency,
+        'seconds': round(wall_seconds, 1),
+        'requests': total,
+        'requests_per_second': round(total / wall_seconds, 1),
+        'p50_ms': round(percentile(all_latencies, 0.50) * 1000, 1) if all_latencies else None,
+        'p95_ms': round(percentile(all_latencies, 0.95) * 1000, 1) if all_latencies else None,
+        'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 1) if all_latencies else None,
+        'error_rate': round(errors / total, 4) if total else None,
+        'rate_limited': limited
+    }
+    return {'summary': summary, 'by_type': by_type, 'timeline': timeline, 'events': events}
+
+
+def print_stage_report(stage):
+    """
+    Print per-request-type results of a stage
+    """
+    print(f"\n{'type':<16} {'count':>7} {'req/s':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} "
+          f"{'max':>8} {'errors':>7} {'429':>5}")
+    for kind, row in stage['by_type'].items():
+        print(f"{kind:<16} {row['requests']:>7} {row['requests_per_second']:>7} {row['p50_ms']:>8} "
+              f"{row['p90_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} {row['max_ms']:>8} "
+              f"{row['error_rate']:>7.2%} {row['rate_limited']:>5}")
+    for event in stage['events']:
+        print(f"POST /update: status {event['status']} in {event['seconds']}s")
+
+
+def parse_mix(spec):
+    """
+    Parse "type=weight,..." into {type: weight}
+    """
+    mix = {}
+    for entry in spec.split(','):
+        name, _, weight = entry.strip().partition('=')
+        if name not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown request type {name!r} (use {', '.join(REQUEST_TYPES)})")
+        mix[name] = float(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the crop price prediction app')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Server to test (default: %(default)s)')
+    parser.add_argument('--start-server', action='store_true', help='Start gunicorn on the --url port first')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers with --start-server')
+    parser.add_argument('--server-pid', type=int, help='Master PID of an already running server (for memory)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8],
+                        help='Concurrent clients; several values run one stage each (default: 8)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per stage (default: 30)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Request mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Skew of the market popularity (default: 1.1)')
+    parser.add_argument('--update-at', type=float, nargs='*', help='Seconds into each stage to fire POST /update')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between timeline samples (default: 5)')
+    parser.add_argument('--output', help='Write the full results as JSON to this file')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    admin_token = os.environ.get('ADMIN_TOKEN', '')
+
+    server = None
+    startup = None
+    master_pid = args.server_pid
+    if args.start_server:
+        print(f"Starting gunicorn with {args.workers} workers on port {port}...")
+        server, startup = start_server(port, args.workers, {'ADMIN_TOKEN': admin_token} if admin_token else {})
+        master_pid = server.pid
+        print(f"Live after {startup['seconds_to_live']}s, ready after {startup['seconds_to_ready']}s")
+
+    traffic = TrafficModel(args.mix, args.zipf)
+    stages = []
+    try:
+        for concurrency in args.concurrency:
+            stage = run_stage(host, port, traffic, concurrency, args.duration, args.interval,
+                              args.update_at, admin_token, master_pid)
+            print_stage_report(stage)
+            stages.append(stage)
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+    print(f"\n{'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'429':>5}")
+    for stage in stages:
+        s = stage['summary']
+        print(f"{s['concurrency']:>7} {s['requests_per_second']:>8} {s['p50_ms']:>8} {s['p95_ms']:>8} "
+              f"{s['p99_ms']:>8} {s['error_rate'] or 0:>7.2%} {s['rate_limited']:>5}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': args.url, 'mix': args.mix, 'startup': startup, 'stages': stages}, f, indent=2)
+        print(f"\nResults written to {args.output}")
@@ -0,0 +1,339 @@
+"""
+Request Metrics Module
+Collects per-stage timings and counters and renders them in Prometheus text format
+
+Every process keeps its own metrics. Under gunicorn (see gunicorn.conf.py) each worker also
+writes them to a file in a shared directory every second, and /metrics reports the sum
+over all workers, so counters stay monotonic whichever worker answers a scrape. Files of
+workers that exited are kept, so their counts are not lost; only their gauges are dropped.
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# Histogram buckets in seconds (Prometheus default buckets plus a few slow ones)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix for every metric name exposed on /metrics
+METRIC_PREFIX = 'crop_price_'
+
+# Requests slower than this (milliseconds) are logged with a stage breakdown; 0 disables
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0') or 0)
+
+# Directory shared by the worker processes (see gunicorn.conf.py)
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join('data', 'metrics'))
+
+# Seconds between writes of a worker's metrics to METRICS_DIR
+METRICS_FLUSH_SECONDS = 1.0
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) -> float
+_gauges = {}        # (name, labels) -> float
+_histograms = {}    # (name, labels) -> [bucket_counts, sum, count]
+_help = {}          # name -> (type, help text)
+
+# Spans recorded for the request currently handled by this thread
+_local = threading.local()
+
+# Directory metrics are aggregated through (None: metrics of this process only)
+_multiprocess_dir = None
+_dirty = False
+
+
+def _label_key(labels):
+    """
+    Convert a labels dict into a hashable, sorted tuple
+    """
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name, metric_type, help_text):
+    """
+    Register type and help text for a metric (shown in /metrics output)
+    """
+    _help[name] = (metric_type, help_text)
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increment a counter
+    """
+    global _dirty
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+        _dirty = True
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set a gauge to the given value
+    """
+    global _dirty
+    key = (name, _label_key(labels))
+    with _lock:
+        _gauges[key] = value
+        _dirty = True
+
+
+def observe(name, value, **labels):
+    """
+    Record one observation (in seconds) in a histogram
+    """
+    global _dirty
+    key = (name, _label_key(labels))
+    index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        _dirty = True
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = [[0] * (len(DEFAULT_BUCKETS) + 1), 0.0, 0]
+            _histograms[key] = hist
+        hist[0][index] += 1
+        hist[1] += value
+        hist[2] += 1
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time a block of code as a named stage
+    The duration is added to the stage histogram and to the current request's spans
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_duration_seconds', elapsed, stage=stage)
+        spans = getattr(_local, 'spans', None)
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def begin_request():
+    """
+    Start collecting spans for the request handled by this thread
+    """
+    _local.spans = []
+    _local.start = time.perf_counter()
+
+
+def end_request(endpoint, method, status):
+    """
+    Finish the current request: record counters and duration, log if slow
+    Returns the request duration in seconds (or None if begin_request was not called)
+    """
+    start = getattr(_local, 'start', None)
+    spans = getattr(_local, 'spans', None) or []
+    _local.spans = None
+    _local.start = None
+    if start is None:
+        return None
+
+    elapsed = time.perf_counter() - start
+    endpoint = endpoint or 'unknown'
+    inc('requests_total', endpoint=endpoint, method=method, status=status)
+    observe('request_duration_seconds', elapsed, endpoint=endpoint)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ', '.join(f"{stage}={secs * 1000:.1f}ms" for stage, secs in spans)
+        print(f"Slow request: {method} {endpoint} -> {status} took {elapsed * 1000:.1f}ms"
+              f" [{breakdown or 'no stages'}]")
+    return elapsed
+
+
+def _format_labels(labels, extra=None):
+    """
+    Format a labels tuple as Prometheus label text
+    """
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    escaped = []
+    for key, value in items:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """
+    Format a number for Prometheus text output
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _snapshot():
+    """
+    Copy the metrics of this process
+    Returns (counters, gauges, histograms) dicts
+    """
+    with _lock:
+        return (dict(_counters), dict(_gauges),
+                {key: (list(h[0]), h[1], h[2]) for key, h in _histograms.items()})
+
+
+def enable_multiprocess(directory=METRICS_DIR):
+    """
+    Aggregate the metrics of all worker processes through files in `directory`
+    Called once in the gunicorn master before workers are forked; removes the files of
+    an earlier run, so a restarted server starts counting from zero
+    """
+    global _multiprocess_dir
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+    _multiprocess_dir = directory
+
+
+def start_worker():
+    """
+    Called in each forked worker: forget the counters and histograms inherited from the
+    master (so they are not counted once per worker) and start writing this worker's
+    metrics to the shared directory
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    if _multiprocess_dir is not None:
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        if _dirty:
+            flush()
+
+
+def flush():
+    """
+    Write the metrics of this process to the shared directory (no-op without one)
+    """
+    global _dirty
+    if _multiprocess_dir is None:
+        return
+    with _lock:
+        _dirty = False
+    counters, gauges, histograms = _snapshot()
+    data = {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'gauges': [[name, labels, value] for (name, labels), value in gauges.items()],
+        'histograms': [[name, labels, *hist] for (name, labels), hist in histograms.items()]
+    }
+    path = os.path.join(_multiprocess_dir, f'{os.getpid()}.json')
+    temp_path = f'{path}.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write metrics: {str(e)}")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _collect():
+    """
+    Metrics to report: the sum over all worker files when aggregating across processes,
+    otherwise those of this process
+    Returns (counters, gauges, histograms) dicts
+    """
+    if _multiprocess_dir is None:
+        return _snapshot()
+
+    flush()
+    counters, gauges, histograms = {}, {}, {}
+    for name in os.listdir(_multiprocess_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(_multiprocess_dir, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        for metric, labels, value in data['counters']:
+            key = (metric, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        # Gauges describe live processes; report the highest value
+        if _process_alive(int(name[:-5])):
+            for metric, labels, value in data['gauges']:
+                key = (metric, tuple(map(tuple, labels)))
+                gauges[key] = max(gauges.get(key, value), value)
+        for metric, labels, buckets, total, count in data['histograms']:
+            key = (metric, tuple(map(tuple, labels)))
+            merged = histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            histograms[key] = ([a + b for a, b in zip(merged[0], buckets)], merged[1] + total, merged[2] + count)
+    return counters, gauges, histograms
+
+
+def render_prometheus():
+    """
+    Render all metrics in Prometheus text exposition format (version 0.0.4)
+    """
+    counters, gauges, histograms = _collect()
+
+    lines = []
+
+    def header(name, default_type):
+        metric_type, help_text = _help.get(name, (default_type, name.replace('_', ' ')))
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+
+    for source, metric_type in ((counters, 'counter'), (gauges, 'gauge')):
+        for name in sorted({key[0] for key in source}):
+            header(name, metric_type)
+            for (metric, labels), value in sorted(source.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for name in sorted({key[0] for key in histograms}):
+        header(name, 'histogram')
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(DEFAULT_BUCKETS + (float('inf'),), buckets):
+                cumulative += bucket_count
+                le = ('le', _format_value(bound))
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}")
+
+    return '\n'.join(lines) + '\n'
+
+
+describe('requests_total', 'counter', 'HTTP requests handled, by endpoint, method and status')
+describe('request_duration_seconds', 'histogram', 'End-to-end request duration')
+describe('stage_duration_seconds', 'histogram', 'Duration of individual request stages')
+describe('model_cache_hits_total', 'counter', 'Requests served by an up-to-date model without retraining')
+describe('model_retrains_total', 'counter', 'Model retrains triggered, by reason')
+describe('prediction_failures_total', 'counter', 'Predictions that failed, by endpoint and reason')
+describe('request_errors_total', 'counter', 'Unhandled exceptions inside request handlers')
+describe('prediction_batches_total', 'counter', 'Model calls made by the batched async prediction path')
+describe('batched_predictions_total', 'counter', 'Predictions answered by the batched async prediction path')
+describe('cold_start_seconds', 'gauge', 'Startup time spent importing the app and warming up, by phase')
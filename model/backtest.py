@@ -0,0 +1,284 @@
+"""
+Walk-Forward Backtesting for Crop Price Prediction
+Replays history to measure how forecasts at different horizons actually performed
+
+For each cutoff date T, a model is trained on the rows dated up to T only and used to
+predict the prices recorded after T. Each of those rows is assigned to the smallest
+horizon h (in days) with date - T <= h, so sparse data (not every crop and district has a
+price every day) is evaluated too. Errors are aggregated per crop, district and horizon.
+
+The features are computed once with the same preprocessing as training and cached on disk
+per data version, so repeated backtests skip that step. Cutoffs are evaluated in parallel
+worker processes that memory-map the cached features.
+
+Usage:
+    python -m model.backtest
+    python -m model.backtest --horizons 7 30 90 --step-days 14 --output backtest.csv
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import snapshots
+from model.train_model import load_training_data, preprocess_data, create_model
+
+# On-disk cache of preprocessed features, one directory per data version
+BACKTEST_CACHE_DIR = os.path.join('model', 'backtest_cache')
+
+# Bump when the cached arrays change, so old caches are not reused
+FEATURE_CACHE_FORMAT = 1
+
+# Default forecast horizons in days
+DEFAULT_HORIZONS = [7, 30, 90, 180]
+
+# Cutoffs are only evaluated if at least this many rows are available for training
+MIN_TRAIN_ROWS = 50
+
+# Cached features loaded once per worker process by _init_worker
+_worker_data = None
+
+
+def _feature_cache_key():
+    """
+    Identify the dataset the features are computed from
+    Uses the data snapshot version, or the CSV modification time and size for an
+    unversioned data file
+    """
+    version = snapshots.version_key('data', 'crop_price_data.csv')
+    return f"{version}-f{FEATURE_CACHE_FORMAT}"
+
+
+def build_feature_cache():
+    """
+    Compute the training features of the current dataset and store them as .npy files
+    Reuses the cached files if the dataset has not changed
+    Returns path of the cache directory
+    """
+    with snapshots.pinned():
+        key = _feature_cache_key()
+        cache_dir = os.path.join(BACKTEST_CACHE_DIR, key)
+        if os.path.exists(os.path.join(cache_dir, 'meta.json')):
+            print(f"Using cached features {key}")
+            return cache_dir
+
+        df = load_training_data()
+        if df is None:
+            raise SystemExit("Error: Could not load training data")
+        X, y = preprocess_data(df)
+        if X is None:
+            raise SystemExit("Error: Data preprocessing failed")
+
+    rows = df.loc[X.index]
+    crops, crop_codes = np.unique(rows['Crop'].astype(str), return_inverse=True)
+    districts, district_codes = np.unique(rows['District'].astype(str), return_inverse=True)
+
+    # Write to a temporary directory and rename, so a crashed run never leaves a partial cache
+    os.makedirs(BACKTEST_CACHE_DIR, exist_ok=True)
+    temp_dir = f"{cache_dir}.tmp.{os.getpid()}"
+    os.makedirs(temp_dir, exist_ok=True)
+    np.save(os.path.join(temp_dir, 'X.npy'), X.to_numpy(dtype=np.float32))
+    np.save(os.path.join(temp_dir, 'y.npy'), y.to_numpy(dtype=np.float64))
+    np.save(os.path.join(temp_dir, 'dates.npy'),
+            pd.to_datetime(rows['Date']).to_numpy().astype('datetime64[D]'))
+    np.save(os.path.join(temp_dir, 'crops.npy'), crop_codes.astype(np.int32))
+    np.save(os.path.join(temp_dir, 'districts.npy'), district_codes.astype(np.int32))
+    with open(os.path.join(temp_dir, 'meta.json'), 'w') as f:
+        json.dump({'feature_names': X.columns.tolist(), 'crops': crops.tolist(),
+                   'districts': districts.tolist()}, f)
+    try:
+        os.rename(temp_dir, cache_dir)
+    except OSError:
+        # Another run cached the same dataset meanwhile
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Keep only the cache of the current dataset
+    for name in os.listdir(BACKTEST_CACHE_DIR):
+        if name != key and '.tmp.' not in name:
+            shutil.rmtree(os.path.join(BACKTEST_CACHE_DIR, name), ignore_errors=True)
+
+    print(f"Cached features {key}: {len(X)} rows, {X.shape[1]} features")
+    return cache_dir
+
+
+def load_feature_cache(cache_dir):
+    """
+    Load cached features; the arrays are memory-mapped, so worker processes share them
+    Returns dict with X, y, dates, crops, districts (arrays) and meta
+    """
+    data = {name: np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r')
+            for name in ('X', 'y', 'dates', 'crops', 'districts')}
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        data['meta'] = json.load(f)
+    return data
+
+
+def _init_worker(cache_dir):
+    """
+    Load the cached features once in each worker process
+    """
+    global _worker_data
+    _worker_data = load_feature_cache(cache_dir)
+
+
+def evaluate_cutoff(data, cutoff, horizons):
+    """
+    Train on rows dated up to cutoff and predict the rows within the largest horizon after it
+    cutoff: numpy datetime64[D]
+    horizons: Sorted list of horizons in days
+    Returns dict of arrays (horizon, crop, district, actual, predicted), or None if there is
+    too little training data or nothing to predict
+    """
+    dates = data['dates']
+    days_ahead = (dates - cutoff).astype(np.int64)
+    train = days_ahead <= 0
+    test = (days_ahead > 0) & (days_ahead <= horizons[-1])
+    if train.sum() < MIN_TRAIN_ROWS or not test.any():
+        return None
+
+    # Parallelism comes from the worker processes, not from the trees
+    model = create_model(n_jobs=1)
+    model.fit(data['X'][train], data['y'][train])
+    predicted = np.maximum(model.predict(data['X'][test]), 0)
+
+    horizon_array = np.asarray(horizons)
+    return {
+        'horizon': horizon_array[np.searchsorted(horizon_array, days_ahead[test])],
+        'crop': np.asarray(data['crops'][test]),
+        'district': np.asarray(data['districts'][test]),
+        'actual': np.asarray(data['y'][test]),
+        'predicted': predicted
+    }
+
+
+def _evaluate_cutoff_in_worker(cutoff, horizons):
+    return evaluate_cutoff(_worker_data, cutoff, horizons)
+
+
+def default_cutoffs(dates, horizons, step_days=30, min_train_days=180):
+    """
+    Cutoff dates every step_days, starting min_train_days after the first date and ending
+    the largest horizon before the last date, so every cutoff is evaluated on all horizons
+    Returns list of numpy datetime64[D]
+    """
+    first = dates.min() + np.timedelta64(min_train_days, 'D')
+    last = dates.max() - np.timedelta64(max(horizons), 'D')
+    return list(np.arange(first, last + np.timedelta64(1, 'D'), np.timedelta64(step_days, 'D')))
+
+
+def summarize_errors(errors, by):
+    """
+    Aggregate prediction errors
+    errors: DataFrame with actual and predicted columns
+    by: Columns to group by
+    Returns DataFrame with Count, MAE, RMSE, MAPE (%) and Bias (mean predicted - actual)
+    """
+    diff = errors['predicted'] - errors['actual']
+    frame = errors[by].assign(
+        abs_error=diff.abs(),
+        sq_error=diff ** 2,
+        pct_error=(diff.abs() / errors['actual'].where(errors['actual'] != 0)) * 100,
+        error=diff
+    )
+    grouped = frame.groupby(by)
+    return pd.DataFrame({
+        'Count': grouped.size(),
+        'MAE': grouped['abs_error'].mean().round(2),
+        'RMSE': np.sqrt(grouped['sq_error'].mean()).round(2),
+        'MAPE': grouped['pct_error'].mean().round(2),
+        'Bias': grouped['error'].mean().round(2)
+    }).reset_index()
+
+
+def run_backtest(horizons=None, cutoffs=None, step_days=30, min_train_days=180, workers=None):
+    """
+    Run a walk-forward backtest over many cutoffs in parallel
+    horizons: Forecast horizons in days (default: DEFAULT_HORIZONS)
+    cutoffs: Cutoff dates (default: every step_days, see default_cutoffs)
+    workers: Number of worker processes (default: number of CPUs)
+    Returns DataFrame of errors per Crop, District and Horizon
+    """
+    horizons = sorted(set(horizons or DEFAULT_HORIZONS))
+    cache_dir = build_feature_cache()
+    data = load_feature_cache(cache_dir)
+
+    if cutoffs is None:
+        cutoffs = default_cutoffs(data['dates'], horizons, step_days, min_train_days)
+    else:
+        cutoffs = [np.datetime64(cutoff, 'D') for cutoff in cutoffs]
+    if len(cutoffs) == 0:
+        raise SystemExit("Error: No cutoff dates; the data covers too short a period")
+
+    workers = workers or os.cpu_count() or 1
+    print(f"Backtesting {len(cutoffs)} cutoffs ({cutoffs[0]} to {cutoffs[-1]}), "
+          f"horizons {horizons} days, with {workers} workers")
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(cache_dir,)) as executor:
+        futures = [executor.submit(_evaluate_cutoff_in_worker, cutoff, horizons) for cutoff in cutoffs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            if result is not None:
+                results.append(result)
+            if done % 10 == 0 or done == len(futures):
+                print(f"  {done}/{len(futures)} cutoffs evaluated")
+
+    if not results:
+        raise SystemExit("Error: No cutoff had enough data to evaluate")
+
+    meta = data['meta']
+    errors = pd.DataFrame({
+        'Crop': np.asarray(meta['crops'])[np.concatenate([r['crop'] for r in results])],
+        'District': np.asarray(meta['districts'])[np.concatenate([r['district'] for r in results])],
+        'Horizon': np.concatenate([r['horizon'] for r in results]),
+        'actual': np.concatenate([r['actual'] for r in results]),
+        'predicted': np.concatenate([r['predicted'] for r in results])
+    })
+
+    print(f"Evaluated {len(errors)} predictions in {time.perf_counter() - started:.1f}s")
+    print("\nErrors by horizon (days):")
+    print(summarize_errors(errors, ['Horizon']).to_string(index=False))
+
+    return summarize_errors(errors, ['Crop', 'District', 'Horizon'])
+
+
+if __name__ == '__main__':
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of the price model')
+    parser.add_argument('--horizons', type=int, nargs='+', default=DEFAULT_HORIZONS,
+                        help='Forecast horizons in days (default: 7 30 90 180)')
+    parser.add_argument('--start', type=parse_date, help='First cutoff date')
+    parser.add_argument('--end', type=parse_date, help='Last cutoff date')
+    parser.add_argument('--step-days', type=int, default=30, help='Days between cutoffs (default: 30)')
+    parser.add_argument('--min-train-days', type=int, default=180,
+                        help='Days of history before the first default cutoff (default: 180)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--output', help='Write errors per crop, district and horizon to this CSV file')
+    args = parser.parse_args()
+
+    cutoffs = None
+    if args.start and args.end:
+        cutoffs = []
+        cutoff = args.start
+        while cutoff <= args.end:
+            cutoffs.append(cutoff)
+            cutoff += timedelta(days=args.step_days)
+    elif args.start or args.end:
+        parser.error('--start and --end must be given together')
+
+    summary = run_backtest(args.horizons, cutoffs, args.step_days, args.min_train_days, args.workers)
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f"\nWrote {len(summary)} rows to {args.output}")
+    else:
+        print("\nErrors by crop, district and horizon:")
+        print(summary.to_string(index=False))
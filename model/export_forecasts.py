@@ -0,0 +1,226 @@
+"""
+Bulk Forecast Export
+Computes predicted prices for every crop x district x date over a horizon and writes them
+to a CSV or Parquet file, without going through the web API
+
+Dates are split into chunks that are predicted in parallel worker processes (one vectorized
+model call per chunk). Chunks are written as soon as they are ready, in order, and only a
+few chunks are in flight at a time, so memory stays bounded for any horizon.
+
+Usage:
+    python -m model.export_forecasts --output forecasts.csv
+    python -m model.export_forecasts --days 730 --format parquet --output forecasts.parquet
+"""
+
+import os
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import snapshots
+from model.predict import predict_prices
+
+# Output columns
+EXPORT_COLUMNS = ['Date', 'Crop', 'District', 'PredictedPrice']
+
+# Model loaded once per worker process by _init_worker
+_worker_model = None
+_worker_feature_names = None
+
+
+def get_model_targets(feature_names):
+    """
+    Crops and districts the model was trained on (from its one-hot feature names)
+    Returns (crops, districts)
+    """
+    crops = [name[len('Crop_'):] for name in feature_names if name.startswith('Crop_')]
+    districts = [name[len('District_'):] for name in feature_names if name.startswith('District_')]
+    return crops, districts
+
+
+def _init_worker(model_path, feature_path):
+    """
+    Load the model once in each worker process
+    """
+    global _worker_model, _worker_feature_names
+    with open(model_path, 'rb') as f:
+        _worker_model = pickle.load(f)
+    with open(feature_path, 'rb') as f:
+        _worker_feature_names = pickle.load(f)
+    # Parallelism comes from the worker processes, not from the trees
+    if hasattr(_worker_model, 'n_jobs'):
+        _worker_model.n_jobs = 1
+
+
+def _predict_chunk(dates, crops, districts):
+    """
+    Predict all crop x district combinations for a chunk of dates with one model call
+    Returns DataFrame with EXPORT_COLUMNS
+    """
+    items = [(crop, district, day) for day in dates for crop in crops for district in districts]
+    prices = predict_prices(items, _worker_model, _worker_feature_names)
+    if prices is None:
+        raise RuntimeError(f"Prediction failed for {dates[0]} to {dates[-1]}")
+
+    return pd.DataFrame({
+        'Date': [day.strftime('%Y-%m-%d') for _, _, day in items],
+        'Crop': [crop for crop, _, _ in items],
+        'District': [district for _, district, _ in items],
+        'PredictedPrice': [round(price, 2) for price in prices]
+    }, columns=EXPORT_COLUMNS)
+
+
+class ForecastWriter:
+    """
+    Streams DataFrame chunks to a CSV or Parquet file
+    The file is written under a temporary name and renamed when complete
+    """
+
+    def __init__(self, path, file_format):
+        self.path = path
+        self.file_format = file_format
+        self.temp_path = f"{path}.tmp.{os.getpid()}"
+        self._parquet_writer = None
+        self._first_chunk = True
+
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401 (optional dependency, only needed for Parquet)
+            except ImportError:
+                raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+
+    def write(self, chunk):
+        if self.file_format == 'csv':
+            chunk.to_csv(self.temp_path, mode='w' if self._first_chunk else 'a',
+                         header=self._first_chunk, index=False)
+        else:
+            import pyarrow
+            import pyarrow.parquet
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self.temp_path, table.schema)
+            self._parquet_writer.write_table(table)
+        self._first_chunk = False
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if os.path.exists(self.temp_path):
+            os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def _link_model_files(directory):
+    """
+    Hard-link (or copy, where links are not supported) the model files of the pinned
+    snapshot into a private directory
+    The links keep the files alive even if the snapshot is cleaned up by another process
+    Returns (model_path, feature_path) inside the directory
+    """
+    paths = []
+    for name in ('trained_model.pkl', 'feature_names.pkl'):
+        source = snapshots.snapshot_path('model', name)
+        target = os.path.join(directory, name)
+        if not os.path.exists(source):
+            raise SystemExit("Model not found. Please train the model first: python -m model.train_model")
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        paths.append(target)
+    return tuple(paths)
+
+
+def export_forecasts(output, start_date=None, days=365, file_format='csv', workers=None,
+                     chunk_days=14, crops=None, districts=None):
+    """
+    Export predicted prices for all crops x districts x dates in [start_date, start_date + days)
+    workers: Number of worker processes (default: number of CPUs)
+    chunk_days: Number of dates predicted per model call
+    crops, districts: Restrict the export (default: everything the model was trained on)
+    Returns number of rows written
+    """
+    # Use one model snapshot for the whole export: the pin is held until every worker has
+    # finished, and workers load the model from private links to its files, since worker
+    # processes may start late in the run and pins do not protect against other processes
+    with snapshots.pinned(), tempfile.TemporaryDirectory(prefix='export-model-', dir='model') as model_dir:
+        model_path, feature_path = _link_model_files(model_dir)
+        return _export(output, model_path, feature_path, start_date, days, file_format, workers,
+                       chunk_days, crops, districts)
+
+
+def _export(output, model_path, feature_path, start_date, days, file_format, workers,
+            chunk_days, crops, districts):
+    """
+    Run the export with the given model files (see export_forecasts)
+    """
+    with open(feature_path, 'rb') as f:
+        model_crops, model_districts = get_model_targets(pickle.load(f))
+    crops = crops or model_crops
+    districts = districts or model_districts
+
+    start_date = start_date or date.today()
+    all_dates = [start_date + timedelta(days=i) for i in range(days)]
+    chunks = [all_dates[i:i + chunk_days] for i in range(0, len(all_dates), chunk_days)]
+    workers = workers or os.cpu_count() or 1
+    total_rows = len(all_dates) * len(crops) * len(districts)
+
+    writer = ForecastWriter(output, file_format)
+    print(f"Exporting {total_rows} forecasts ({len(crops)} crops x {len(districts)} districts x "
+          f"{days} days) with {workers} workers to {output}")
+
+    rows_written = 0
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_path, feature_path)) as executor:
+            # Keep only a few chunks in flight so memory stays bounded
+            window = workers * 2
+            pending = []
+            for chunk in chunks:
+                pending.append(executor.submit(_predict_chunk, chunk, crops, districts))
+                if len(pending) >= window:
+                    frame = pending.pop(0).result()
+                    writer.write(frame)
+                    rows_written += len(frame)
+            for future in pending:
+                frame = future.result()
+                writer.write(frame)
+                rows_written += len(frame)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {rows_written} rows in {elapsed:.2f}s ({rows_written / elapsed:,.0f} rows/s)")
+    return rows_written
+
+
+if __name__ == '__main__':
+    def parse_date(value):
+        return date.fromisoformat(value)
+
+    parser = argparse.ArgumentParser(description='Export forecasts for all crops, districts and dates')
+    parser.add_argument('--output', required=True, help='Output file')
+    parser.add_argument('--format', choices=['csv', 'parquet'], help='Output format (default: from file extension)')
+    parser.add_argument('--start', type=parse_date, help='First forecast date (default: today)')
+    parser.add_argument('--days', type=int, default=365, help='Number of days to forecast (default: 365)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-days', type=int, default=14, help='Dates per model call (default: 14)')
+    parser.add_argument('--crops', nargs='+', help='Only these crops')
+    parser.add_argument('--districts', nargs='+', help='Only these districts')
+    args = parser.parse_args()
+
+    output_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    export_forecasts(args.output, args.start, args.days, output_format, args.workers,
+                     args.chunk_days, args.crops, args.districts)
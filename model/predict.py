@@ -5,41 +5,92 @@ Handles making predictions using the trained model
 
 import os
 import pickle
-import pandas as pd
-import numpy as np
+import threading
+import snapshots
+from lazy_import import lazy_import
+
+# pandas and NumPy are imported on first use to keep application startup fast
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+# In-memory model registry: (model version, model, feature_names), replaced as a whole so
+# readers never see a model paired with another model's feature names.
+# The loaded model is reused until a new model snapshot is published
+_model_registry = (None, None, None)
+_registry_lock = threading.Lock()
+
+
+def _model_files_key(model_path, feature_path):
+    """
+    Identify unversioned model files (from before snapshots were used) by modification
+    time and size
+    Returns None if either file is missing
+    """
+    try:
+        model_stat = os.stat(model_path)
+        feature_stat = os.stat(feature_path)
+    except OSError:
+        return None
+    return (model_stat.st_mtime_ns, model_stat.st_size, feature_stat.st_mtime_ns, feature_stat.st_size)
 
 
 def load_model():
     """
-    Load trained model and feature names from disk
+    Load trained model and feature names
+    Reads the model snapshot pinned by the current request (or the current one)
+    The model is kept in memory and only re-read from disk after it has been retrained
     Returns model and feature_names tuple
     """
-    model_path = os.path.join('model', 'trained_model.pkl')
-    feature_path = os.path.join('model', 'feature_names.pkl')
+    global _model_registry
     
-    if not os.path.exists(model_path) or not os.path.exists(feature_path):
+    version = snapshots.resolve('model')
+    model_path = snapshots.snapshot_path('model', 'trained_model.pkl')
+    feature_path = snapshots.snapshot_path('model', 'feature_names.pkl')
+    
+    key = version if version is not None else _model_files_key(model_path, feature_path)
+    if key is None:
         return None, None
     
-    try:
-        with open(model_path, 'rb') as f:
-            model = pickle.load(f)
+    cached_key, model, feature_names = _model_registry
+    if cached_key == key:
+        return model, feature_names
+    
+    with _registry_lock:
+        # Another thread may have loaded it while we waited
+        cached_key, model, feature_names = _model_registry
+        if cached_key == key:
+            return model, feature_names
         
-        with open(feature_path, 'rb') as f:
-            feature_names = pickle.load(f)
+        try:
+            with open(model_path, 'rb') as f:
+                model = pickle.load(f)
+            
+            with open(feature_path, 'rb') as f:
+                feature_names = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+            return None, None
         
+        _model_registry = (key, model, feature_names)
         return model, feature_names
-    except Exception as e:
-        print(f"Error loading model: {str(e)}")
-        return None, None
 
 
-def encode_features(crop, district, selected_date):
+def is_model_loaded():
+    """
+    Check whether a model is currently held in the in-memory registry
+    """
+    return _model_registry[1] is not None
+
+
+def encode_features(crop, district, selected_date, feature_names=None):
     """
     Encode crop, district, and date into feature vector
+    feature_names: Feature list of an already loaded model (loaded from disk if not given)
     Returns pandas DataFrame with encoded features
     """
     # Load feature names to know what features to create
-    model, feature_names = load_model()
+    if feature_names is None:
+        model, feature_names = load_model()
     if feature_names is None:
         return None
     
@@ -69,19 +120,21 @@ def encode_features(crop, district, selected_date):
     return features
 
 
-def predict_price(crop, district, selected_date):
+def predict_price(crop, district, selected_date, model=None, feature_names=None):
     """
     Predict crop price for given crop, district, and date
+    model, feature_names: Already loaded model (loaded from disk if not given)
     Returns predicted price in ₹ per quintal
     """
     # Load model
-    model, feature_names = load_model()
+    if model is None or feature_names is None:
+        model, feature_names = load_model()
     if model is None:
         print("Error: Model not found. Please train the model first.")
         return None
     
     # Encode features
-    features = encode_features(crop, district, selected_date)
+    features = encode_features(crop, district, selected_date, feature_names)
     if features is None:
         print("Error: Feature encoding failed")
         return None
@@ -104,6 +157,53 @@ def predict_price(crop, district, selected_date):
         return None
 
 
+def encode_features_batch(items, feature_names):
+    """
+    Encode many (crop, district, date) items into one feature matrix
+    Returns pandas DataFrame with one row per item, columns in training order
+    """
+    column_index = {name: i for i, name in enumerate(feature_names)}
+    values = np.zeros((len(items), len(feature_names)))
+    
+    for row, (crop, district, selected_date) in enumerate(items):
+        # Crop and district one-hot features
+        for col in (f'Crop_{crop}', f'District_{district}'):
+            if col in column_index:
+                values[row, column_index[col]] = 1
+        
+        # Date features (day, month, year)
+        for col, value in (('Day', selected_date.day), ('Month', selected_date.month),
+                           ('Year', selected_date.year)):
+            if col in column_index:
+                values[row, column_index[col]] = value
+    
+    return pd.DataFrame(values, columns=feature_names)
+
+
+def predict_prices(items, model=None, feature_names=None):
+    """
+    Predict prices for many (crop, district, date) items with a single model call
+    model, feature_names: Already loaded model (loaded from disk if not given)
+    Returns list of predicted prices in ₹ per quintal (same order as items), or None on failure
+    """
+    if model is None or feature_names is None:
+        model, feature_names = load_model()
+    if model is None:
+        print("Error: Model not found. Please train the model first.")
+        return None
+    
+    if len(items) == 0:
+        return []
+    
+    try:
+        features = encode_features_batch(items, feature_names)
+        predictions = model.predict(features)
+        return [max(0, float(p)) for p in predictions]  # Ensure non-negative prices
+    except Exception as e:
+        print(f"Error making batch prediction: {str(e)}")
+        return None
+
+
 if __name__ == '__main__':
     # Test prediction
     from datetime import date
@@ -12,15 +12,22 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 from datetime import datetime
 import warnings
+import snapshots
+from data.data_handler import get_data_path
 warnings.filterwarnings('ignore')
 
+# File names inside a model snapshot
+MODEL_FILE = 'trained_model.pkl'
+FEATURE_FILE = 'feature_names.pkl'
+METADATA_FILE = 'model_metadata.pkl'
+
 
 def load_training_data():
     """
     Load training data from CSV file
     Returns pandas DataFrame
     """
-    data_path = os.path.join('data', 'crop_price_data.csv')
+    data_path = get_data_path()
     
     if not os.path.exists(data_path):
         print(f"Warning: Data file not found at {data_path}")
@@ -101,6 +108,23 @@ def preprocess_data(df):
     return X, y
 
 
+def create_model(n_jobs=-1):
+    """
+    Create an untrained Random Forest Regressor
+    n_jobs: Cores used for training and prediction (-1 = all available cores)
+    Returns RandomForestRegressor
+    """
+    # Parameters optimized for crop price prediction
+    return RandomForestRegressor(
+        n_estimators=100,      # Number of trees
+        max_depth=15,          # Maximum depth of trees
+        min_samples_split=5,   # Minimum samples to split
+        min_samples_leaf=2,    # Minimum samples in leaf
+        random_state=42,
+        n_jobs=n_jobs
+    )
+
+
 def train_random_forest(X, y):
     """
     Train Random Forest Regressor model
@@ -115,15 +139,7 @@ def train_random_forest(X, y):
     )
     
     # Initialize Random Forest Regressor
-    # Parameters optimized for crop price prediction
-    rf_model = RandomForestRegressor(
-        n_estimators=100,      # Number of trees
-        max_depth=15,          # Maximum depth of trees
-        min_samples_split=5,   # Minimum samples to split
-        min_samples_leaf=2,    # Minimum samples in leaf
-        random_state=42,
-        n_jobs=-1              # Use all available cores
-    )
+    rf_model = create_model()
     
     # Train the model
     print("Training Random Forest model...")
@@ -150,31 +166,34 @@ def train_random_forest(X, y):
 def save_model(model, feature_names):
     """
     Save trained model and feature names to disk
+    All three files are written to a staging directory and published together as a new
+    model snapshot (see snapshots.py), so readers never see a model paired with the
+    feature names of another model
+    Returns the new model version
     """
-    model_dir = 'model'
-    os.makedirs(model_dir, exist_ok=True)
+    staging_dir = snapshots.create_staging('model')
     
     # Save model
-    model_path = os.path.join(model_dir, 'trained_model.pkl')
-    with open(model_path, 'wb') as f:
+    with open(os.path.join(staging_dir, MODEL_FILE), 'wb') as f:
         pickle.dump(model, f)
-    print(f"Model saved to {model_path}")
     
     # Save feature names
-    feature_path = os.path.join(model_dir, 'feature_names.pkl')
-    with open(feature_path, 'wb') as f:
+    with open(os.path.join(staging_dir, FEATURE_FILE), 'wb') as f:
         pickle.dump(feature_names, f)
-    print(f"Feature names saved to {feature_path}")
     
     # Save training metadata
     metadata = {
         'training_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'model_type': 'RandomForestRegressor',
-        'n_features': len(feature_names)
+        'n_features': len(feature_names),
+        'data_version': snapshots.resolve('data')
     }
-    metadata_path = os.path.join(model_dir, 'model_metadata.pkl')
-    with open(metadata_path, 'wb') as f:
+    with open(os.path.join(staging_dir, METADATA_FILE), 'wb') as f:
         pickle.dump(metadata, f)
+    
+    version = snapshots.publish('model', staging_dir)
+    print(f"Model saved as snapshot {version}")
+    return version
 
 
 def train_model():
@@ -186,6 +205,16 @@ def train_model():
     print("Crop Price Prediction Model Training")
     print("=" * 50)
     
+    # Read one data snapshot throughout, so the saved model records the data it was trained on
+    with snapshots.pinned():
+        return _train_and_save()
+
+
+def _train_and_save():
+    """
+    Load data, train the model and save it
+    Returns True if successful, False otherwise
+    """
     # Load data
     df = load_training_data()
     if df is None:
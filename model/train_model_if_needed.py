@@ -6,7 +6,15 @@ Handles daily retraining logic
 import os
 import pickle
 from datetime import datetime, timedelta
-from model.train_model import train_model
+import snapshots
+
+
+# When to retrain: 'daily' (model older than one day) or 'drift' (only when the monitor
+# reports drift after an update, see data/monitor.py, or the model is too old)
+RETRAIN_POLICY = os.environ.get('RETRAIN_POLICY', 'daily')
+
+# Under the drift policy, a model older than this (days) is retrained anyway
+MAX_MODEL_AGE_DAYS = int(os.environ.get('MAX_MODEL_AGE_DAYS', '30'))
 
 
 def get_model_metadata():
@@ -14,7 +22,7 @@ def get_model_metadata():
     Get model metadata if it exists
     Returns metadata dict or None
     """
-    metadata_path = os.path.join('model', 'model_metadata.pkl')
+    metadata_path = snapshots.snapshot_path('model', 'model_metadata.pkl')
     if os.path.exists(metadata_path):
         try:
             with open(metadata_path, 'rb') as f:
@@ -28,8 +36,9 @@ def should_retrain_model():
     """
     Check if model should be retrained
     Returns True if model doesn't exist or is older than 1 day
+    (MAX_MODEL_AGE_DAYS with RETRAIN_POLICY=drift)
     """
-    model_path = os.path.join('model', 'trained_model.pkl')
+    model_path = snapshots.snapshot_path('model', 'trained_model.pkl')
     
     # If model doesn't exist, need to train
     if not os.path.exists(model_path):
@@ -40,11 +49,12 @@ def should_retrain_model():
     if metadata is None:
         return True
     
-    # Check if model is older than 1 day
+    # Check if model is older than 1 day (or the maximum age under the drift policy)
+    max_age_days = MAX_MODEL_AGE_DAYS if RETRAIN_POLICY == 'drift' else 1
     try:
         training_date = datetime.strptime(metadata['training_date'], '%Y-%m-%d %H:%M:%S')
         days_old = (datetime.now() - training_date).days
-        return days_old >= 1
+        return days_old >= max_age_days
     except:
         return True
 
@@ -55,6 +65,9 @@ def train_model_if_needed(force_retrain=False):
     force_retrain: If True, retrain regardless of last training date
     """
     if force_retrain or should_retrain_model():
+        # Imported here because it pulls in scikit-learn, which is slow to import
+        from model.train_model import train_model
+        
         print("Model training required...")
         success = train_model()
         if success:
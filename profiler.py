@@ -0,0 +1,191 @@
+"""
+Sampling Profiler Module
+Captures call-stack samples of a single request thread and stores them on disk
+Profiles are written in collapsed-stack format (one "frame;frame;frame count" line per stack),
+which can be opened with speedscope or flamegraph.pl
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+
+
+# Directory where captured profiles are stored
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Number of most recent profiles kept on disk
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+
+# Fraction of requests profiled automatically (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0') or 0)
+
+# Seconds between two stack samples
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+
+# File extension of stored profiles
+PROFILE_EXTENSION = '.folded'
+
+_write_lock = threading.Lock()
+
+
+def should_sample():
+    """
+    Decide whether the current request is picked by random sampling
+    """
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(code):
+    """
+    Short label for a code object: function (last two path parts:first line)
+    """
+    parts = code.co_filename.replace('\\', '/').rsplit('/', 2)
+    filename = '/'.join(parts[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of one thread from a background thread
+    The profiled thread runs unmodified; only the sampler thread does extra work
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start sampling in a daemon thread
+        """
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampler thread to finish
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        """
+        Sampler loop: record the target thread's stack every interval
+        """
+        sampler_code = self._run.__code__
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                if frame.f_code is not sampler_code:
+                    stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def to_collapsed(self):
+        """
+        Render the collected samples in collapsed-stack format
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _safe_name(text):
+    """
+    Make a string safe for use in a file name
+    """
+    return ''.join(ch if ch.isalnum() or ch in '-_' else '-' for ch in text)[:40]
+
+
+def save_profile(profiler, label):
+    """
+    Write a finished profile to PROFILE_DIR and prune old profiles
+    Returns the stored file name
+    """
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    name = f"{timestamp}_{_safe_name(label)}_{int(profiler.duration * 1000)}ms{PROFILE_EXTENSION}"
+
+    with _write_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(profiler.to_collapsed())
+        _prune_profiles()
+    return name
+
+
+def _prune_profiles():
+    """
+    Delete all but the PROFILE_KEEP most recent profiles
+    """
+    for name in list_profiles()[PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name['name']))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """
+    List stored profiles, most recent first
+    Returns list of dicts with name, size and created timestamp
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(PROFILE_EXTENSION):
+            continue
+        try:
+            stat = os.stat(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            continue
+        profiles.append({
+            'name': name,
+            'size': stat.st_size,
+            'created': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    # File names start with a sortable timestamp
+    profiles.sort(key=lambda p: p['name'], reverse=True)
+    return profiles
+
+
+def get_profile_path(name):
+    """
+    Resolve a stored profile name to its path
+    Returns None if the name is invalid or the profile does not exist
+    """
+    if os.path.basename(name) != name or not name.endswith(PROFILE_EXTENSION):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+if __name__ == '__main__':
+    # Profile a small pandas workload and print the hottest stacks
+    import pandas as pd
+
+    profiler = SamplingProfiler(interval=0.001).start()
+    frame = pd.DataFrame({'a': range(200000), 'b': range(200000)})
+    for _ in range(20):
+        frame.groupby(frame['a'] % 100)['b'].mean()
+    profiler.stop()
+    print(f"Collected {sum(profiler.samples.values())} samples in {profiler.duration:.2f}s")
+    print(profiler.to_collapsed()[:1000])
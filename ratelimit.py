@@ -0,0 +1,329 @@
+"""
+Rate Limiting and Admission Control
+Token-bucket rate limits per client and route, and concurrency caps with a bounded
+queueing time for expensive stages (model training, chart rendering)
+
+Buckets are kept in memory per process by default. Set RATE_LIMIT_BACKEND=sqlite to share
+them between the gunicorn workers on one machine through a local SQLite file.
+Concurrency caps always hold across all workers on the machine (through locked slot files),
+since a sync gunicorn worker only ever runs one request itself.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Rate limits per Flask endpoint as "endpoint=requests/seconds", comma separated.
+# A client may send `requests` requests in a burst, refilled evenly over `seconds`
+RATE_LIMITS_SPEC = os.environ.get(
+    'RATE_LIMITS',
+    'predict=30/60,api_predict=120/60,update_data=2/3600'
+)
+
+# Set RATE_LIMIT_ENABLED=false to disable rate limiting
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# Where buckets are stored: 'memory' (per process) or 'sqlite' (shared by local processes)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+
+# SQLite file used by the shared backend
+RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', os.path.join('data', 'ratelimit.sqlite3'))
+
+# Directory of the slot files that cap expensive stages across worker processes
+CONCURRENCY_LOCK_DIR = os.environ.get('CONCURRENCY_LOCK_DIR', os.path.join('data', 'locks'))
+
+# Seconds between attempts to take a slot held by another process
+SLOT_POLL_SECONDS = 0.05
+
+# Buckets untouched for this long (seconds) are full again and are dropped
+BUCKET_IDLE_SECONDS = 24 * 3600
+
+
+class Overloaded(Exception):
+    """
+    Raised when an expensive stage cannot be admitted within its queueing time
+    """
+
+    def __init__(self, stage, retry_after):
+        super().__init__(f"Server busy ({stage}), please retry in {retry_after} seconds")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+def parse_rate_limits(spec):
+    """
+    Parse "endpoint=requests/seconds,..." into {endpoint: (capacity, refill per second)}
+    """
+    limits = {}
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        endpoint, _, rate = entry.partition('=')
+        requests_allowed, _, seconds = rate.partition('/')
+        capacity = float(requests_allowed)
+        limits[endpoint.strip()] = (capacity, capacity / float(seconds))
+    return limits
+
+
+def _refill(tokens, updated, now, capacity, refill_rate):
+    """
+    Tokens in a bucket after refilling it from `updated` to `now`
+    """
+    return min(capacity, tokens + (now - updated) * refill_rate)
+
+
+def _decide(tokens, capacity, refill_rate, cost):
+    """
+    Take `cost` tokens if available
+    Returns (allowed, tokens left, seconds until the request would be allowed)
+    """
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / refill_rate if refill_rate > 0 else float('inf')
+
+
+class MemoryBackend:
+    """
+    Token buckets in a dict of this process
+    """
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+        self._last_cleanup = time.monotonic()
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        """
+        Take tokens from a bucket
+        Returns (allowed, retry_after_seconds)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, refill_rate)
+            allowed, tokens, retry_after = _decide(tokens, capacity, refill_rate, cost)
+            self._buckets[key] = (tokens, now)
+
+            if now - self._last_cleanup > BUCKET_IDLE_SECONDS:
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < BUCKET_IDLE_SECONDS}
+                self._last_cleanup = now
+        return allowed, retry_after
+
+
+class SqliteBackend:
+    """
+    Token buckets in a local SQLite file, shared by all processes on the machine
+    Each update runs in an immediate transaction, so concurrent workers cannot both
+    take the last token
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Create the schema on a connection of its own that is closed right away: this runs at
+        # import time, in the gunicorn master, and a connection must never cross fork()
+        connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        """
+        One connection per thread and process (SQLite connections must not be shared
+        between threads, nor inherited by forked worker processes)
+        """
+        pid = os.getpid()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != pid:
+            # Opened lazily, so every forked worker opens its own
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+            self._local.pid = pid
+        return connection
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        """
+        Take tokens from a bucket
+        Returns (allowed, retry_after_seconds)
+        """
+        # Wall-clock time, because the buckets are shared between processes
+        now = time.time()
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            tokens = _refill(tokens, updated, now, capacity, refill_rate)
+            allowed, tokens, retry_after = _decide(tokens, capacity, refill_rate, cost)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                connection.execute('DELETE FROM buckets WHERE updated < ?', (now - BUCKET_IDLE_SECONDS,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+
+class RateLimiter:
+    """
+    Per-client, per-endpoint token-bucket rate limiter
+    """
+
+    def __init__(self, limits, backend):
+        self.limits = limits
+        self.backend = backend
+
+    def check(self, endpoint, client):
+        """
+        Count one request of a client to an endpoint
+        Returns seconds the client has to wait, or 0 if the request is allowed
+        """
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            return 0
+        capacity, refill_rate = limit
+        try:
+            allowed, retry_after = self.backend.take(f"{endpoint}|{client}", capacity, refill_rate)
+        except sqlite3.Error as e:
+            # Never turn a storage problem into an outage
+            print(f"Rate limiter unavailable, allowing request: {str(e)}")
+            return 0
+        if allowed:
+            return 0
+        metrics.inc('rate_limited_total', endpoint=endpoint)
+        return max(1, int(retry_after + 0.999))
+
+
+def create_rate_limiter():
+    """
+    Build the rate limiter configured by the environment
+    Returns RateLimiter, or None if rate limiting is disabled
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None
+    backend = SqliteBackend() if RATE_LIMIT_BACKEND == 'sqlite' else MemoryBackend()
+    return RateLimiter(parse_rate_limits(RATE_LIMITS_SPEC), backend)
+
+
+class ConcurrencyLimiter:
+    """
+    Caps how many requests run an expensive stage at the same time, across all worker
+    processes on the machine: each of the max_concurrency slots is a file that the
+    running request holds an exclusive lock on (released by the OS if the process dies)
+    Further callers wait in line for at most queue_timeout seconds
+    """
+
+    def __init__(self, stage, max_concurrency, queue_timeout, lock_dir=CONCURRENCY_LOCK_DIR):
+        self.stage = stage
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.lock_dir = lock_dir
+        # Threads of this process queue on the semaphore; processes compete for the slot files
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._held = threading.local()
+
+    def _take_slot(self):
+        """
+        Lock the first free slot file
+        Returns the open slot file, or None if all slots are held
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        for slot in range(self.max_concurrency):
+            slot_file = open(os.path.join(self.lock_dir, f'{self.stage}.{slot}.lock'), 'a+')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(slot_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    slot_file.seek(0)
+                    msvcrt.locking(slot_file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                slot_file.close()
+                continue
+            return slot_file
+        return None
+
+    def try_acquire(self, timeout=None):
+        """
+        Wait for a free slot for at most timeout seconds (default: queue_timeout; 0 does not wait)
+        Returns True if a slot was acquired (release it with release() in the same thread)
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.perf_counter()
+        acquired = self._semaphore.acquire(timeout=timeout)
+        if acquired:
+            slot_file = self._take_slot()
+            while slot_file is None and time.perf_counter() - started < timeout:
+                time.sleep(min(SLOT_POLL_SECONDS, max(0.0, timeout - (time.perf_counter() - started))))
+                slot_file = self._take_slot()
+            if slot_file is None:
+                self._semaphore.release()
+                acquired = False
+            else:
+                self._held.slot_file = slot_file
+        metrics.observe('admission_wait_seconds', time.perf_counter() - started, stage=self.stage)
+        if not acquired:
+            metrics.inc('overloaded_total', stage=self.stage)
+        return acquired
+
+    def release(self):
+        slot_file = getattr(self._held, 'slot_file', None)
+        self._held.slot_file = None
+        if slot_file is not None:
+            slot_file.close()  # Closing the file releases its lock
+        self._semaphore.release()
+
+    @contextmanager
+    def admit(self, timeout=None):
+        """
+        Run a block in a free slot
+        timeout: Seconds to wait for a slot (default: queue_timeout)
+        Raises Overloaded if no slot frees up in time
+        """
+        if not self.try_acquire(timeout):
+            raise Overloaded(self.stage, max(1, int(self.queue_timeout)))
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Concurrency caps of the expensive stages (shared by all worker processes)
+training_limiter = ConcurrencyLimiter(
+    'train_model',
+    int(os.environ.get('TRAINING_CONCURRENCY', '1')),
+    float(os.environ.get('TRAINING_QUEUE_TIMEOUT', '30'))
+)
+chart_limiter = ConcurrencyLimiter(
+    'generate_trend_graph',
+    int(os.environ.get('CHART_CONCURRENCY', '2')),
+    float(os.environ.get('CHART_QUEUE_TIMEOUT', '5'))
+)
+
+
+metrics.describe('rate_limited_total', 'counter', 'Requests rejected by the rate limiter, by endpoint')
+metrics.describe('overloaded_total', 'counter', 'Expensive stages not admitted within their queueing time')
+metrics.describe('admission_wait_seconds', 'histogram', 'Time spent waiting for a slot of an expensive stage')
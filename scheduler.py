@@ -1,78 +1,226 @@
 """
 Daily Update Scheduler
 Automatically updates data and retrains model daily
+When several processes start the scheduler (e.g. one per gunicorn worker), they elect a
+single leader through a file lock; only the leader runs jobs. Job progress is persisted
+so that a job interrupted by a restart is resumed by the next leader.
 """
 
+import os
+import json
 import schedule
 import time
 import threading
-from datetime import datetime
-from data.data_handler import update_daily_data, get_last_updated_date
-from model.train_model_if_needed import train_model_if_needed
+import ratelimit
+from datetime import datetime, timedelta
+from data.data_handler import update_daily_data, get_last_updated_date, get_data_watermark
+from data import aggregates, monitor
+from model.train_model_if_needed import train_model_if_needed, RETRAIN_POLICY
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
-def daily_update_job():
+
+# Seconds a job waits for the training slot while a request (e.g. /update) is training
+SCHEDULED_TRAINING_TIMEOUT = 3600
+
+# Lock file held by the process that runs the scheduled jobs
+SCHEDULER_LOCK_PATH = os.path.join('data', 'scheduler.lock')
+
+# Persisted state of the last (or currently running) job
+SCHEDULER_STATE_PATH = os.path.join('data', 'scheduler_state.json')
+
+# Seconds between leadership attempts by processes that are not the leader
+LEADER_RETRY_SECONDS = 60
+
+# Open lock file of this process while it is the leader
+_leader_lock_file = None
+
+
+def _timestamp():
+    """
+    Current time formatted for log messages
+    """
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def try_acquire_leadership():
+    """
+    Try to become the scheduler leader by taking an exclusive lock on SCHEDULER_LOCK_PATH
+    The lock is released by the OS when the process exits, so a crashed leader is replaced
+    Returns True if this process is the leader
+    """
+    global _leader_lock_file
+    if _leader_lock_file is not None:
+        return True
+
+    os.makedirs(os.path.dirname(SCHEDULER_LOCK_PATH), exist_ok=True)
+    lock_file = open(SCHEDULER_LOCK_PATH, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return False
+
+    # Record who holds the lock (for diagnostics only)
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()} {_timestamp()}\n")
+    lock_file.flush()
+
+    _leader_lock_file = lock_file
+    return True
+
+
+def load_job_state():
     """
-    Job to run daily - updates data and retrains model
+    Load the persisted job state
+    Returns dict (empty if no job has run yet)
     """
-    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting daily update job...")
     try:
-        # Update data
-        update_daily_data()
-        
-        # Retrain model with new data
-        train_model_if_needed(force_retrain=True)
-        
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Daily update completed successfully!")
+        with open(SCHEDULER_STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_job_state(state):
+    """
+    Persist the job state atomically
+    """
+    os.makedirs(os.path.dirname(SCHEDULER_STATE_PATH), exist_ok=True)
+    temp_path = f"{SCHEDULER_STATE_PATH}.tmp.{os.getpid()}"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, SCHEDULER_STATE_PATH)
+
+
+def daily_update_job(resume_from=None):
+    """
+    Job to run daily - updates data, checks it with the monitor and retrains model
+    Each step is recorded in the job state before it starts. Both steps write their
+    output atomically, so after an interruption a step is either fully done or not at all.
+    resume_from: Step to start from when resuming an interrupted job ('update_data' or 'retrain')
+    """
+    print(f"\n[{_timestamp()}] Starting daily update job...")
+    state = {
+        'job': 'daily_update',
+        'status': 'running',
+        'step': resume_from or 'update_data',
+        'started_at': _timestamp(),
+        'pid': os.getpid()
+    }
+    try:
+        # Update and retrain in the shared training slot, like /update does
+        with ratelimit.training_limiter.admit(timeout=SCHEDULED_TRAINING_TIMEOUT):
+            if state['step'] == 'update_data':
+                save_job_state(state)
+                # Update data; after downtime, fill all missing days instead of only today
+                latest_date = get_data_watermark()
+                if latest_date is not None and latest_date < datetime.now().date() - timedelta(days=1):
+                    from data.backfill import backfill_missing_data
+                    rows_added = backfill_missing_data(retrain=False)
+                else:
+                    rows_added = update_daily_data()
+                state.update(step='retrain', rows_added=rows_added)
+
+            save_job_state(state)
+            # Check the new rows and the current model's error on them before retraining
+            drift_detected = True
+            try:
+                drift_detected = monitor.run_monitor()['drift']['drift_detected']
+            except Exception as e:
+                print(f"[{_timestamp()}] Monitor failed, retraining anyway: {str(e)}")
+
+            # Retrain model with new data (with RETRAIN_POLICY=drift only if the model drifted).
+            # Without new rows (e.g. the feed has no prices for today yet) there is nothing to learn
+            if state.get('rows_added') == 0:
+                print(f"[{_timestamp()}] No new data, keeping the current model")
+                train_model_if_needed()  # Still trains if there is no model or it is too old
+            elif RETRAIN_POLICY == 'drift' and not drift_detected:
+                print(f"[{_timestamp()}] No drift detected, keeping the current model")
+                train_model_if_needed()  # Still trains if there is no model or it is too old
+            else:
+                train_model_if_needed(force_retrain=True)
+
+        # Rebuild the comparison cube for the new data and model
+        aggregates.refresh()
+
+        state.update(status='completed', finished_at=_timestamp())
+        save_job_state(state)
+        print(f"[{_timestamp()}] Daily update completed successfully!")
         print(f"Last updated: {get_last_updated_date()}")
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error in daily update: {str(e)}")
+        state.update(status='failed', finished_at=_timestamp(), error=str(e))
+        save_job_state(state)
+        print(f"[{_timestamp()}] Error in daily update: {str(e)}")
 
 
-def run_scheduler():
+def resume_interrupted_job():
     """
-    Run the scheduler in a background thread
+    Resume a job that was still marked as running when its process stopped
+    Called by a process right after it becomes the leader
     """
-    # Schedule daily update at 2:00 AM
-    schedule.every().day.at("02:00").do(daily_update_job)
-    
-    # Also check every hour if update is needed
-    schedule.every().hour.do(check_and_update)
-    
-    print("Daily update scheduler started!")
-    print("Updates will run daily at 2:00 AM")
-    print("Also checking hourly for updates...")
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+    state = load_job_state()
+    if state.get('status') != 'running':
+        return
+
+    print(f"[{_timestamp()}] Resuming interrupted {state.get('job')} job "
+          f"(started {state.get('started_at')} by pid {state.get('pid')}, step {state.get('step')})")
+    daily_update_job(resume_from=state.get('step'))
 
 
 def check_and_update():
     """
     Check if update is needed and update if necessary
+    Compares the data watermark (latest date) with today instead of loading the dataset
     """
     try:
-        import pandas as pd
-        from data.data_handler import load_data
-        from datetime import datetime, timedelta
-        
-        df = load_data()
-        if df is None:
+        latest_date = get_data_watermark()
+        if latest_date is None:
             return
-        
-        df['Date'] = pd.to_datetime(df['Date'])
-        latest_date = df['Date'].max().date()
-        today = datetime.now().date()
-        
+
         # If data is older than today, update
-        if latest_date < today:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Data update needed, triggering update...")
+        if latest_date < datetime.now().date():
+            print(f"[{_timestamp()}] Data update needed, triggering update...")
             daily_update_job()
     except Exception as e:
         print(f"Error checking for updates: {str(e)}")
 
 
+def run_scheduler():
+    """
+    Run the scheduler in a background thread
+    Waits until this process becomes the leader, then runs the scheduled jobs
+    """
+    while not try_acquire_leadership():
+        time.sleep(LEADER_RETRY_SECONDS)
+
+    print(f"Scheduler leader elected (pid {os.getpid()})")
+    resume_interrupted_job()
+
+    # Schedule daily update at 2:00 AM
+    schedule.every().day.at("02:00").do(daily_update_job)
+
+    # Also check every hour if update is needed
+    schedule.every().hour.do(check_and_update)
+
+    print("Daily update scheduler started!")
+    print("Updates will run daily at 2:00 AM")
+    print("Also checking hourly for updates...")
+
+    while True:
+        schedule.run_pending()
+        time.sleep(60)  # Check every minute
+
+
 def start_scheduler_thread():
     """
     Start scheduler in a separate thread
@@ -86,4 +234,3 @@ if __name__ == '__main__':
     # Test the scheduler
     print("Testing daily update scheduler...")
     daily_update_job()
-
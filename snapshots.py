@@ -0,0 +1,298 @@
+"""
+Snapshot Module
+Versioned, immutable snapshots of the dataset and the trained model
+
+Writers build a new version in a private staging directory and publish it by renaming the
+directory into place and atomically swapping a CURRENT pointer file. Published versions are
+never modified, so readers can never see a half-written CSV or a model paired with the
+feature names of another model. A request pins the versions that were current when it
+started and reads only those, even if a newer version is published meanwhile.
+
+Layout (for kind 'data'; 'model' is the same under model/):
+    data/snapshots/CURRENT          name of the current version, e.g. v000012
+    data/snapshots/v000012/...      files of one version
+"""
+
+import os
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Base directory of each snapshot kind
+SNAPSHOT_ROOTS = {
+    'data': 'data',
+    'model': 'model',
+}
+
+# Number of most recent versions always kept
+SNAPSHOT_KEEP = int(os.environ.get('SNAPSHOT_KEEP', '3'))
+
+# Older versions are only deleted once they are at least this old (seconds), so that
+# requests in other processes that pinned them can finish
+SNAPSHOT_GRACE_SECONDS = int(os.environ.get('SNAPSHOT_GRACE_SECONDS', '300'))
+
+# Staging directories left behind by crashed writers are removed after this many seconds
+STAGING_MAX_AGE_SECONDS = 3600
+
+_local = threading.local()
+
+# Versions pinned by requests in this process: (kind, version) -> number of pins
+_pinned_counts = {}
+_pinned_lock = threading.Lock()
+
+
+def snapshot_root(kind):
+    """
+    Directory that holds all versions of a snapshot kind
+    """
+    return os.path.join(SNAPSHOT_ROOTS[kind], 'snapshots')
+
+
+def _pointer_path(kind):
+    """
+    Path of the CURRENT pointer file of a snapshot kind
+    """
+    return os.path.join(snapshot_root(kind), 'CURRENT')
+
+
+def current_version(kind):
+    """
+    Name of the currently published version, or None if nothing was published yet
+    """
+    try:
+        with open(_pointer_path(kind)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def resolve(kind):
+    """
+    Version this thread should read: the pinned one if the thread has a pin, else the current one
+    """
+    pinned = getattr(_local, 'pinned', None)
+    if pinned is not None and kind in pinned:
+        return pinned[kind]
+    return current_version(kind)
+
+
+def snapshot_path(kind, filename):
+    """
+    Path of a file in the version this thread should read
+    Falls back to the unversioned location (e.g. data/crop_price_data.csv) if no version
+    was published yet, so existing installations keep working until their first update
+    """
+    version = resolve(kind)
+    if version is None:
+        return os.path.join(SNAPSHOT_ROOTS[kind], filename)
+    return os.path.join(snapshot_root(kind), version, filename)
+
+
+def version_key(kind, filename):
+    """
+    Identify the version of a kind this thread reads, for use in cache keys
+    Unversioned files (before the first snapshot) are identified by modification time and size
+    """
+    version = resolve(kind)
+    if version is not None:
+        return version
+    try:
+        stat = os.stat(snapshot_path(kind, filename))
+    except OSError:
+        return 'missing'
+    return f"file-{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def _set_pin(kind, version):
+    """
+    Pin one kind to a version for this thread, keeping the in-process pin counts in sync
+    """
+    pinned = _local.pinned
+    with _pinned_lock:
+        old = pinned.get(kind)
+        if old is not None:
+            _pinned_counts[(kind, old)] -= 1
+            if _pinned_counts[(kind, old)] <= 0:
+                del _pinned_counts[(kind, old)]
+        if version is not None:
+            _pinned_counts[(kind, version)] = _pinned_counts.get((kind, version), 0) + 1
+    pinned[kind] = version
+
+
+def pin():
+    """
+    Pin the current version of every kind for this thread (e.g. at the start of a request)
+    """
+    if getattr(_local, 'pinned', None) is None:
+        _local.pinned = {}
+    for kind in SNAPSHOT_ROOTS:
+        _set_pin(kind, current_version(kind))
+
+
+def unpin():
+    """
+    Release this thread's pins (e.g. at the end of a request)
+    """
+    if getattr(_local, 'pinned', None) is None:
+        return
+    for kind in list(_local.pinned):
+        _set_pin(kind, None)
+    _local.pinned = None
+
+
+def repin(kind):
+    """
+    Move this thread's pin of one kind to the current version, e.g. after waiting for
+    another writer that may have published a newer one
+    Returns the current version
+    """
+    version = current_version(kind)
+    if getattr(_local, 'pinned', None) is not None:
+        _set_pin(kind, version)
+    return version
+
+
+@contextmanager
+def pinned():
+    """
+    Context manager that pins the current versions for the duration of a block
+    If the thread already holds pins (e.g. inside a request), those are kept as they are
+    """
+    if getattr(_local, 'pinned', None) is not None:
+        yield
+        return
+    pin()
+    try:
+        yield
+    finally:
+        unpin()
+
+
+def create_staging(kind):
+    """
+    Create a private staging directory in which a writer builds a new version
+    """
+    root = snapshot_root(kind)
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f".staging-{os.getpid()}-{threading.get_ident()}-{time.time_ns()}")
+    os.makedirs(path)
+    return path
+
+
+def list_versions(kind):
+    """
+    Names of all published versions, oldest first
+    """
+    root = snapshot_root(kind)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if name.startswith('v') and name[1:].isdigit())
+
+
+@contextmanager
+def _pointer_lock(kind):
+    """
+    Exclusive cross-process lock around publishing, so the pointer only moves forward
+    """
+    lock_file = open(os.path.join(snapshot_root(kind), '.lock'), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        lock_file.close()
+
+
+@contextmanager
+def writer_lock(kind):
+    """
+    Exclusive cross-process lock around a whole read-modify-publish cycle, so concurrent
+    writers (e.g. /update and the scheduled job) cannot build on the same version and drop
+    each other's changes. Inside the block this thread's pin (if any) is moved to the
+    current version, so the writer reads the latest published version
+    """
+    root = snapshot_root(kind)
+    os.makedirs(root, exist_ok=True)
+    lock_file = open(os.path.join(root, '.writer.lock'), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        repin(kind)
+        yield
+    finally:
+        lock_file.close()
+
+
+def publish(kind, staging_dir):
+    """
+    Publish a staging directory as the new current version
+    The directory is renamed into place and the CURRENT pointer is swapped atomically
+    Returns the new version name
+    """
+    root = snapshot_root(kind)
+    with _pointer_lock(kind):
+        versions = list_versions(kind)
+        number = int(versions[-1][1:]) + 1 if versions else 1
+        version = f"v{number:06d}"
+        os.rename(staging_dir, os.path.join(root, version))
+
+        temp_pointer = f"{_pointer_path(kind)}.tmp.{os.getpid()}"
+        with open(temp_pointer, 'w') as f:
+            f.write(version)
+        os.replace(temp_pointer, _pointer_path(kind))
+
+    # A writer that holds a pin reads its own write from now on
+    if getattr(_local, 'pinned', None) is not None:
+        _set_pin(kind, version)
+
+    collect_garbage(kind)
+    return version
+
+
+def collect_garbage(kind):
+    """
+    Delete old versions that are no longer needed
+    Keeps the SNAPSHOT_KEEP newest versions, the current one, versions pinned in this
+    process and versions younger than SNAPSHOT_GRACE_SECONDS
+    """
+    root = snapshot_root(kind)
+    versions = list_versions(kind)
+    keep = set(versions[-SNAPSHOT_KEEP:]) if SNAPSHOT_KEEP > 0 else set()
+    keep.add(current_version(kind))
+    with _pinned_lock:
+        keep.update(version for (pinned_kind, version) in _pinned_counts if pinned_kind == kind)
+
+    now = time.time()
+    for version in versions:
+        if version in keep:
+            continue
+        path = os.path.join(root, version)
+        try:
+            if now - os.path.getmtime(path) >= SNAPSHOT_GRACE_SECONDS:
+                shutil.rmtree(path)
+        except OSError:
+            pass
+
+    # Remove staging directories of writers that crashed before publishing
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith('.staging-'):
+            try:
+                if now - os.path.getmtime(path) >= STAGING_MAX_AGE_SECONDS:
+                    shutil.rmtree(path)
+            except OSError:
+                pass